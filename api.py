@@ -13,14 +13,111 @@ API = {_p + "version_helper" : {"arguments" : ("filename str", ),
                                               "source_types" : "iterable of str",
                                               "no_invariant_check" : "bool",
                                               "dry_run" : "bool",
-                                              "silent" : "bool"},
+                                              "silent" : "bool",
+                                              "rehash" : "bool",
+                                              "workers" : "int",
+                                              "check_processes" : "int",
+                                              "check_timeout" : "float",
+                                              "use_git" : "bool",
+                                              "staged" : "bool",
+                                              "include" : "iterable of glob str",
+                                              "exclude" : "iterable of glob str",
+                                              "source_files" : "iterable of filename str",
+                                              "output_format" : "str",
+                                              "changelog" : "filename str",
+                                              "force_check" : "bool"},
                                  "returns" : None,
                                  "exceptions" : ("ValueError", "Missing_Api_Function",
                                                  "Mismatched_Api_Argument",
                                                  "Missing_Api_Info"),
                                  "side_effects" : ("Modifies api VERSION",
                                                    "Modifies database",
-                                                   "Overwrites apichangelog.txt")},
+                                                   "Overwrites changelog file")},
+        _p + "batch_version_helper" : {"keywords" : {"api_filenames" : "iterable of filename str",
+                                                     "root" : "directory str",
+                                                     "processes" : "int",
+                                                     "prerelease" : "str",
+                                                     "build_metadata" : "str",
+                                                     "db" : "filename str",
+                                                     "checker" : "filename str",
+                                                     "source_types" : "iterable of str",
+                                                     "no_invariant_check" : "bool",
+                                                     "dry_run" : "bool",
+                                                     "silent" : "bool",
+                                                     "rehash" : "bool",
+                                                     "workers" : "int",
+                                                     "check_processes" : "int",
+                                                     "check_timeout" : "float",
+                                                     "use_git" : "bool",
+                                                     "staged" : "bool",
+                                                     "include" : "iterable of glob str",
+                                                     "exclude" : "iterable of glob str",
+                                                     "output_format" : "str",
+                                                     "changelog" : "filename str",
+                                                     "force_check" : "bool"},
+                                       "returns" : ("list of dict", ),
+                                       "side_effects" : ("Modifies api VERSION",
+                                                         "Modifies database",
+                                                         "Overwrites changelog file")},
+        _p + "compare_apis" : {"arguments" : ("API dict", "API dict"),
+                               "returns" : ("Change_Report", )},
+        _p + "watch" : {"arguments" : ("filename str", ),
+                        "keywords" : {"directory" : "directory str",
+                                      "db" : "filename str",
+                                      "checker" : "filename str",
+                                      "source_types" : "iterable of str",
+                                      "no_invariant_check" : "bool",
+                                      "workers" : "int",
+                                      "interval" : "float",
+                                      "include" : "iterable of glob str",
+                                      "exclude" : "iterable of glob str"},
+                        "returns" : None},
+        _p + "add_phase_hook" : {"arguments" : ("callable", ),
+                                 "returns" : None},
+        _p + "remove_phase_hook" : {"arguments" : ("callable", ),
+                                    "returns" : None,
+                                    "exceptions" : ("ValueError", )},
+        _p + "Session" : {"keywords" : {"db" : "filename str",
+                                        "checker" : "filename str",
+                                        "source_types" : "iterable of str",
+                                        "no_invariant_check" : "bool",
+                                        "rehash" : "bool",
+                                        "workers" : "int",
+                                        "check_processes" : "int",
+                                        "check_timeout" : "float",
+                                        "use_git" : "bool",
+                                        "staged" : "bool",
+                                        "include" : "iterable of glob str",
+                                        "exclude" : "iterable of glob str",
+                                        "force_check" : "bool",
+                                        "silent" : "bool"},
+                          "returns" : ("Session", )},
+        _p + "Session.plan" : {"arguments" : ("filename str", ),
+                               "keywords" : {"directory" : "directory str",
+                                             "version" : "str",
+                                             "prerelease" : "str",
+                                             "build_metadata" : "str",
+                                             "source_files" : "iterable of filename str"},
+                               "returns" : ("Plan", ),
+                               "exceptions" : ("ValueError", "Missing_Api_Function",
+                                               "Mismatched_Api_Argument",
+                                               "Missing_Api_Info")},
+        _p + "Session.apply" : {"arguments" : ("Plan", ),
+                                "keywords" : {"changelog" : "filename str"},
+                                "returns" : None,
+                                "exceptions" : ("ValueError", "Stale_Plan"),
+                                "side_effects" : ("Modifies api VERSION",
+                                                  "Modifies database",
+                                                  "Overwrites changelog file")},
+        _p + "Session.apply_all" : {"arguments" : ("iterable of Plan", ),
+                                    "keywords" : {"changelog" : "filename str"},
+                                    "returns" : None,
+                                    "exceptions" : ("ValueError", "Stale_Plan"),
+                                    "side_effects" : ("Modifies api VERSION",
+                                                      "Modifies database",
+                                                      "Overwrites changelog file")},
+        _p + "Session.save_caches" : {"returns" : None,
+                                      "side_effects" : ("Modifies database", )},
         _p + "parse_version" : {"arguments" : ("version str", ),
                                  "returns" : ("str", "str", "str", "str", "str")}
        }
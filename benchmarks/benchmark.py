@@ -0,0 +1,273 @@
+"""Times each phase of version_helper on a generated project.
+
+   Usage: python benchmarks/benchmark.py [--api_size 10000] [--output results.json]
+                                         [--baseline baseline.json]
+
+   A synthetic package with the requested number of source files, file size and
+   API entries is written to a temporary directory. Each phase is run --repeat
+   times and the fastest time is reported. The peak memory used to load the api
+   file, and to compare it with the stored API, is measured in new processes.
+   Results are written as JSON; when a baseline file is given, any phase that is
+   slower (or uses more memory) than the baseline by more than --tolerance is
+   reported and the exit status is 1."""
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import shutil
+import StringIO
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from versionhelper import libvh
+from versionhelper import _apifile
+from versionhelper import pychecker
+from versionhelper._serialization import serialize
+
+PACKAGE_NAME = "benchproject"
+TYPES = ("str", "int", "float", "bool", "bytes", "iterable of str", "dict")
+
+PARSER = argparse.ArgumentParser(description="Benchmark the phases of version_helper")
+PARSER.add_argument("--files", help="Number of source files to generate", type=int, default=200)
+PARSER.add_argument("--file_size", help="Approximate size of each source file, in bytes", type=int, default=16384)
+PARSER.add_argument("--api_size", help="Number of API entries to generate", type=int, default=10000)
+PARSER.add_argument("--changes", help="Fraction of API entries that are modified for the change detection phase", type=float, default=0.01)
+PARSER.add_argument("--repeat", help="Number of times each phase is run", type=int, default=3)
+PARSER.add_argument("--seed", help="Seed for the random number generator", type=int, default=0)
+PARSER.add_argument("--output", help="Write the results to the specified file (default: stdout)")
+PARSER.add_argument("--baseline", help="Compare the results with the specified results file")
+PARSER.add_argument("--tolerance", help="Allowed slowdown relative to the baseline, as a fraction", type=float, default=0.25)
+PARSER.add_argument("--keep", help="Do not delete the generated project", action="store_true")
+PARSER.add_argument("--memory_probe", help=argparse.SUPPRESS, nargs=2, metavar=("STAGE", "API_FILE"))
+
+
+def generate_project(directory, files=200, file_size=16384, api_size=10000, seed=0):
+    """Writes a package with files modules and an api.py declaring api_size of their functions to directory.
+
+       Returns the filename of the api file."""
+    generator = random.Random(seed)
+    package_dir = os.path.join(directory, PACKAGE_NAME)
+    os.mkdir(package_dir)
+    with open(os.path.join(package_dir, "__init__.py"), 'w') as _file:
+        _file.write('')
+
+    api_lines = []
+    modules = [[] for _ in range(files)]
+    for number in range(api_size):
+        modules[number % files].append(number)
+    for module_number, functions in enumerate(modules):
+        module_name = "module_{}".format(module_number)
+        source = []
+        for number in functions:
+            positionals = ["arg{}".format(index) for index in range(generator.randint(0, 3))]
+            keywords = ["keyword{}".format(index) for index in range(generator.randint(0, 3))]
+            signature = ", ".join(positionals + ["{}=None".format(keyword) for keyword in keywords])
+            source.append("def function_{}({}):\n    return None\n\n".format(number, signature))
+            entry = ['"arguments" : ({})'.format(''.join('"{} {}", '.format(name, generator.choice(TYPES))
+                                                         for name in positionals))]
+            if keywords:
+                entry.append('"keywords" : {{{}}}'.format(", ".join('"{}" : "{}"'.format(name, generator.choice(TYPES))
+                                                                     for name in keywords)))
+            entry.append('"returns" : ("{}", )'.format(generator.choice(TYPES)))
+            api_lines.append('    "{}.{}.function_{}" : {{{}}},'.format(PACKAGE_NAME, module_name,
+                                                                         number, ", ".join(entry)))
+        source = ''.join(source)
+        padding = max(0, file_size - len(source))
+        source += ''.join("# {}\n".format('x' * 76) for _ in range(padding // 79))
+        with open(os.path.join(package_dir, module_name + ".py"), 'w') as _file:
+            _file.write(source)
+
+    api_filename = os.path.join(directory, "api.py")
+    with open(api_filename, 'w') as _file:
+        _file.write('VERSION = "1.0.0"\nLANGUAGE = "python"\nPROJECT = "{}"\n\n'.format(PACKAGE_NAME))
+        _file.write("API = {\n" + '\n'.join(api_lines) + "\n}\n")
+    # files modified within the last couple of seconds are never cached by _digest
+    mtime = int(time.time()) - 3600
+    for root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            os.utime(os.path.join(root, filename), (mtime, mtime))
+    return api_filename
+
+def modify_api(api, fraction, seed=0):
+    """Returns a copy of api with a fraction of its entries removed, added or given new keywords."""
+    generator = random.Random(seed)
+    api = dict(api)
+    names = sorted(api.keys())
+    for name in generator.sample(names, max(1, int(len(names) * fraction))):
+        choice = generator.randint(0, 2)
+        if choice == 0:
+            del api[name]
+        elif choice == 1:
+            api[name + "_added"] = api[name]
+        else:
+            values = dict(api[name])
+            keywords = dict(values.get("keywords", None) or dict())
+            keywords["new_keyword"] = "str"
+            values["keywords"] = keywords
+            api[name] = values
+    return api
+
+def time_phase(function, repeat):
+    """Returns a list of the wall clock times of repeat calls to function."""
+    times = []
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        function()
+        times.append(timeit.default_timer() - start)
+    return times
+
+def run_benchmarks(api_filename, repeat=3, changes=0.01, seed=0):
+    """Returns a dictionary mapping phase name -> list of times for the project described by api_filename."""
+    directory = os.path.dirname(api_filename)
+    results = dict()
+    results["load"] = time_phase(lambda: _apifile.load(api_filename), repeat)
+    results["load_exec"] = time_phase(lambda: libvh._load_module_from_filename(api_filename, "api"), repeat)
+    api_info = _apifile.load(api_filename)
+    source_types = libvh._determine_source_types(api_info)
+    filenames = libvh._find_source_files(directory, source_types)
+
+    def check():
+        pychecker.forget(filenames)
+        libvh._run_invariant_checker(api_info, False, True, '', directory)
+    results["invariant_check"] = time_phase(check, repeat)
+
+    results["serialize"] = time_phase(lambda: serialize(api_info.API), repeat)
+    serialized_api = serialize(api_info.API)
+
+    db_filename = os.path.join(directory, "api.db")
+    db = libvh._open_database(db_filename)
+    results["package_digest_cold"] = time_phase(lambda: libvh._obtain_package_digest(directory, serialized_api,
+                                                                                     source_types, db, True),
+                                                repeat)
+    results["package_digest_cached"] = time_phase(lambda: libvh._obtain_package_digest(directory, serialized_api,
+                                                                                       source_types, db),
+                                                  repeat)
+    digest, _ = libvh._obtain_package_digest(directory, serialized_api, source_types, db)
+
+    def insert():
+        db.connection.execute("DELETE FROM Api_Info")
+        db.store_api_info(api_info.PROJECT, digest, serialized_api, libvh.DIGEST_FORMAT)
+    results["db_insert"] = time_phase(insert, repeat)
+    results["db_query"] = time_phase(lambda: libvh._obtain_old_api_info(db, api_info.PROJECT, api_info, digest),
+                                     repeat)
+
+    old_api = modify_api(api_info.API, changes, seed)
+    results["change_type"] = time_phase(lambda: libvh._determine_change_type(api_info.API, old_api,
+                                                                             StringIO.StringIO()),
+                                        repeat)
+    return results
+
+def probe_memory(stage, api_filename, changes=0.01, seed=0):
+    """Runs stage ("load" or "diff") of version_helper and returns how much it raised the peak resident set size of this process, in KiB.
+
+       "load" loads the api file. "diff" compares the API with a copy that has a fraction changes of
+       its entries modified, stored in a database, as version_helper does (loading the api file and
+       storing the copy are not measured). Returns None where the peak cannot be reset (it can on Linux)."""
+    if stage == "diff":
+        api_info = _apifile.load(api_filename)
+        db = libvh._open_database(os.path.join(os.path.dirname(api_filename), "memory.db"))
+        db.store_api_info(api_info.PROJECT, "stored", serialize(modify_api(api_info.API, changes, seed)),
+                          libvh.DIGEST_FORMAT)
+    gc.collect()
+    start = _memory_status("VmRSS")
+    try:
+        with open("/proc/self/clear_refs", 'w') as _file:
+            _file.write("5") # resets the peak resident set size
+    except (IOError, OSError):
+        return None
+    if stage == "load":
+        _apifile.load(api_filename)
+    else:
+        _, old_api, _ = libvh._obtain_old_api_info(db, api_info.PROJECT, api_info, "current")
+        libvh._determine_change_type(api_info.API, old_api, StringIO.StringIO())
+    return _memory_status("VmHWM") - start
+
+def _memory_status(field):
+    """Returns the value of field (in KiB) in /proc/self/status."""
+    with open("/proc/self/status", 'r') as _file:
+        for line in _file:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+
+def measure_memory(api_filename, changes=0.01, seed=0):
+    """Returns a dictionary mapping stage -> the peak memory used by the stage in KiB (or None), each measured in a new process."""
+    results = dict()
+    for stage in ("load", "diff"):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+                                          "--memory_probe", stage, api_filename,
+                                          "--changes", str(changes), "--seed", str(seed)])
+        results[stage] = json.loads(output)
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    """Returns a list of (phase, baseline time, time) for the phases that are slower than baseline by more than tolerance."""
+    regressions = []
+    for phase, timing in sorted(results["phases"].items()):
+        try:
+            old_time = baseline["phases"][phase]["best"]
+        except KeyError:
+            continue
+        if timing["best"] > old_time * (1 + tolerance):
+            regressions.append((phase, old_time, timing["best"]))
+    return regressions
+
+def compare_memory(results, baseline, tolerance=0.25):
+    """Returns a list of (stage, baseline peak, peak) for the stages that use more memory than baseline by more than tolerance."""
+    regressions = []
+    for stage, peak in sorted(results.get("peak_memory_kb", dict()).items()):
+        old_peak = baseline.get("peak_memory_kb", dict()).get(stage)
+        if peak is not None and old_peak is not None and peak > old_peak * (1 + tolerance):
+            regressions.append((stage, old_peak, peak))
+    return regressions
+
+def main():
+    args = PARSER.parse_args()
+    if args.memory_probe:
+        stage, api_filename = args.memory_probe
+        print(json.dumps(probe_memory(stage, api_filename, args.changes, args.seed)))
+        return
+    directory = tempfile.mkdtemp(prefix="versionhelper_benchmark_")
+    try:
+        api_filename = generate_project(directory, args.files, args.file_size, args.api_size, args.seed)
+        times = run_benchmarks(api_filename, args.repeat, args.changes, args.seed)
+        peak_memory = measure_memory(api_filename, args.changes, args.seed)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory)
+    results = {"parameters" : {"files" : args.files, "file_size" : args.file_size,
+                               "api_size" : args.api_size, "changes" : args.changes,
+                               "repeat" : args.repeat, "seed" : args.seed},
+               "platform" : {"python" : platform.python_version(), "system" : platform.platform()},
+               "phases" : dict((phase, {"best" : min(samples), "samples" : samples}) for
+                               phase, samples in times.items()),
+               "peak_memory_kb" : peak_memory}
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as _file:
+            _file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as _file:
+            baseline = json.load(_file)
+        if baseline["parameters"] != results["parameters"]:
+            sys.stderr.write("Warning: baseline was recorded with different parameters\n")
+        regressions = compare(results, baseline, args.tolerance)
+        for phase, old_time, new_time in regressions:
+            sys.stderr.write("Regression in {}: {:.4f}s -> {:.4f}s\n".format(phase, old_time, new_time))
+        memory_regressions = compare_memory(results, baseline, args.tolerance)
+        for stage, old_peak, new_peak in memory_regressions:
+            sys.stderr.write("Memory regression in {}: {} KiB -> {} KiB\n".format(stage, old_peak, new_peak))
+        if regressions or memory_regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Times how long the command line tool takes to start, compared with the bare interpreter.
+
+   Usage: python benchmarks/startup.py [--repeat 20] [--output results.json]
+                                       [--baseline baseline.json]
+
+   Each command is run --repeat times in a fresh interpreter and the fastest time is reported:
+   the interpreter alone, `--help`, and a dry run and a no-change run on a small generated project.
+   Results have the same format as those of benchmark.py and are compared with a baseline the same way."""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import timeit
+
+import benchmark
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PARSER = argparse.ArgumentParser(description="Benchmark the startup time of versionhelper.main")
+PARSER.add_argument("--repeat", help="Number of times each command is run", type=int, default=20)
+PARSER.add_argument("--api_size", help="Number of API entries in the generated project", type=int, default=20)
+PARSER.add_argument("--output", help="Write the results to the specified file (default: stdout)")
+PARSER.add_argument("--baseline", help="Compare the results with the specified results file")
+PARSER.add_argument("--tolerance", help="Allowed slowdown relative to the baseline, as a fraction", type=float, default=0.25)
+
+
+def time_command(arguments, repeat, environment, directory):
+    """Returns a list of the wall clock times of repeat runs of arguments."""
+    times = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(repeat):
+            start = timeit.default_timer()
+            subprocess.check_call(arguments, stdout=devnull, env=environment, cwd=directory)
+            times.append(timeit.default_timer() - start)
+    return times
+
+def main():
+    args = PARSER.parse_args()
+    environment = dict(os.environ)
+    environment["PYTHONPATH"] = os.pathsep.join(path for path in (ROOT, os.environ.get("PYTHONPATH")) if path)
+    directory = tempfile.mkdtemp(prefix="versionhelper_startup_")
+    try:
+        api_filename = benchmark.generate_project(directory, 2, 1024, args.api_size)
+        tool = [sys.executable, "-m", "versionhelper.main"]
+        subprocess.check_call(tool + [api_filename, "-s"], env=environment, cwd=directory) # first run
+        commands = {"interpreter" : [sys.executable, "-c", "pass"],
+                    "help" : tool + ["--help"],
+                    "dry_run" : tool + [api_filename, "--dry_run"],
+                    "no_change" : tool + [api_filename]}
+        times = dict((name, time_command(arguments, args.repeat, environment, directory)) for
+                     name, arguments in commands.items())
+    finally:
+        shutil.rmtree(directory)
+    floor = min(times["interpreter"])
+    results = {"parameters" : {"repeat" : args.repeat, "api_size" : args.api_size},
+               "platform" : {"python" : platform.python_version(), "system" : platform.platform()},
+               "phases" : dict((name, {"best" : min(samples), "overhead" : min(samples) - floor,
+                                       "samples" : samples}) for name, samples in times.items())}
+    output = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as _file:
+            _file.write(output + "\n")
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as _file:
+            baseline = json.load(_file)
+        regressions = benchmark.compare(results, baseline, args.tolerance)
+        for name, old_time, new_time in regressions:
+            sys.stderr.write("Regression in {}: {:.4f}s -> {:.4f}s\n".format(name, old_time, new_time))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "versionhelper"))
+
+import _apifile
+
+API_FILE = '''"""Example api file; VERSION = "1.0.0" is mentioned here and must not change."""
+VERSION = '1.0.0' # the version
+PROJECT = "example"
+_p = "example.module."
+API = {_p + "function" : {"arguments" : ("value", -1)}}
+'''
+
+
+class Test_Api_File(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, "api.py")
+        self.write(API_FILE)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, source):
+        with open(self.filename, 'w') as _file:
+            _file.write(source)
+
+    def read(self):
+        with open(self.filename, 'r') as _file:
+            return _file.read()
+
+    def test_load_evaluates_literals(self):
+        api_info = _apifile.load(self.filename)
+        self.assertEqual(api_info.VERSION, "1.0.0")
+        self.assertEqual(api_info.API, {"example.module.function" : {"arguments" : ("value", -1)}})
+        self.assertEqual(api_info.__file__, self.filename)
+
+    def test_load_executes_other_files(self):
+        self.write("import os\nVERSION = os.path.join('1.0', '0').replace(os.sep, '.')\n")
+        self.assertEqual(_apifile.load(self.filename).VERSION, "1.0.0")
+
+    def test_evaluate_rejects_calls(self):
+        self.assertRaises(_apifile.Not_Literal, _apifile.evaluate, "VERSION = str(1)\n")
+
+    def test_version_literal_is_replaced_in_place(self):
+        _apifile.load(self.filename)
+        _apifile.write_version(self.filename, "1.0.0", "1.1.0")
+        self.assertEqual(self.read(), API_FILE.replace("'1.0.0'", "'1.1.0'"))
+
+    def test_version_is_replaced_without_load(self):
+        _apifile.write_version(self.filename, "1.0.0", "2.0.0-beta.1")
+        self.assertEqual(self.read(), API_FILE.replace("'1.0.0'", "'2.0.0-beta.1'"))
+
+    def test_version_is_replaced_after_the_file_changes(self):
+        _apifile.load(self.filename)
+        self.write("# a new first line\n" + API_FILE)
+        _apifile.write_version(self.filename, "1.0.0", "1.0.1")
+        self.assertEqual(self.read(), "# a new first line\n" + API_FILE.replace("'1.0.0'", "'1.0.1'"))
+
+    def test_prefixes_and_triple_quotes_are_kept(self):
+        source = 'VERSION = u"""1.0.0"""\nPROJECT = "example"\n'
+        self.write(source)
+        _apifile.load(self.filename)
+        _apifile.write_version(self.filename, "1.0.0", "1.0.1")
+        self.assertEqual(self.read(), 'VERSION = u"""1.0.1"""\nPROJECT = "example"\n')
+
+    def test_last_assignment_is_replaced(self):
+        source = 'VERSION = "0.1.0"\nVERSION = "1.0.0"\n'
+        self.write(source)
+        self.assertEqual(_apifile.load(self.filename).VERSION, "1.0.0")
+        _apifile.write_version(self.filename, "1.0.0", "1.0.1")
+        self.assertEqual(self.read(), 'VERSION = "0.1.0"\nVERSION = "1.0.1"\n')
+
+    def test_executed_file_falls_back_to_text_replacement(self):
+        source = 'import os\nVERSION = "1.0.0"\n'
+        self.write(source)
+        _apifile.load(self.filename)
+        _apifile.write_version(self.filename, "1.0.0", "1.0.1")
+        self.assertEqual(self.read(), 'import os\nVERSION = "1.0.1"\n')
+
+    def test_patch_version_does_not_write(self):
+        patched = _apifile.patch_version(self.filename, "1.0.0", "1.1.0")
+        self.assertEqual(patched, API_FILE.replace("'1.0.0'", "'1.1.0'"))
+        self.assertEqual(self.read(), API_FILE)
+
+    def test_unchanged_version_is_not_written(self):
+        inode = os.stat(self.filename).st_ino
+        _apifile.write_version(self.filename, "1.0.0", "1.0.0")
+        self.assertEqual(os.stat(self.filename).st_ino, inode) # replace_file would create a new file
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "versionhelper"))
+
+import cchecker
+import libvh
+
+SOURCE = r'''#include <stdio.h>
+#define MAX(a, b) ((a) > (b) ? (a) : (b))
+/* int commented(int a); */
+// int line_commented(int a);
+typedef int (*handler)(int code);
+static int hidden(int a) { return a; }
+extern "C" {
+int add_ints(int a, int b);
+}
+struct point { int x; int y; };
+int printf_like(const char *format, ...);
+void no_args(void);
+void callback(void (*fn)(int, char), int values[3]);
+const char *message = "int fake(int a);";
+unsigned long
+multi_line(int a,
+           int b)
+{
+    int local(int c);
+    return a;
+}
+int unnamed(int, char *);
+int (*returns_pointer(int a))(int);
+'''
+
+
+class Test_Scan_Source(unittest.TestCase):
+
+    def setUp(self):
+        self.prototypes = dict((name, (line, names, varargs)) for name, line, names, varargs in
+                               cchecker.scan_source(SOURCE))
+
+    def test_declarations_and_definitions_are_found(self):
+        self.assertEqual(self.prototypes["add_ints"], (8, ("a", "b"), False))
+        self.assertEqual(self.prototypes["multi_line"], (16, ("a", "b"), False))
+
+    def test_varargs_and_void(self):
+        self.assertEqual(self.prototypes["printf_like"], (11, ("format", ), True))
+        self.assertEqual(self.prototypes["no_args"], (12, (), False))
+
+    def test_parameter_names(self):
+        self.assertEqual(self.prototypes["callback"][1], ("fn", "values"))
+        self.assertEqual(self.prototypes["unnamed"][1], ("arg0", "arg1"))
+
+    def test_ignored_text_is_not_scanned(self):
+        for name in ("commented", "line_commented", "handler", "hidden", "point", "fake", "local",
+                     "returns_pointer", "MAX"):
+            self.assertNotIn(name, self.prototypes)
+
+
+class Test_Index(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_dir = os.path.join(self.directory, "src")
+        os.mkdir(self.source_dir)
+        self.cache_filename = os.path.join(self.directory, "cache", "index")
+        self.write("lib.c", "int add_ints(int a, int b) { return a + b; }\n")
+        self.write("lib.h", "\nint add_ints(int first, int second);\n")
+
+    def tearDown(self):
+        cchecker._INDEXES.clear()
+        cchecker._PENDING.clear()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, source):
+        filename = os.path.join(self.source_dir, name)
+        with open(filename, 'w') as _file:
+            _file.write(source)
+        past = time.time() - 60 # outside of the racy window, so the file can be cached
+        os.utime(filename, (past, past))
+
+    def test_headers_take_precedence(self):
+        index = cchecker.build_index(self.source_dir, self.cache_filename)
+        self.assertEqual([entry[0] for entry in index["add_ints"]],
+                         [os.path.join(self.source_dir, "lib.h"), os.path.join(self.source_dir, "lib.c")])
+        self.assertEqual(index["add_ints"][0][1:], (2, ("first", "second"), False))
+
+    def test_cache_is_only_written_by_save_caches(self):
+        first = cchecker.build_index(self.source_dir, self.cache_filename)
+        self.assertFalse(os.path.exists(self.cache_filename))
+        cchecker.save_caches()
+        self.assertTrue(os.path.exists(self.cache_filename))
+        self.assertEqual(cchecker.build_index(self.source_dir, self.cache_filename), first)
+        self.assertEqual(cchecker._PENDING, dict()) # nothing was scanned again
+
+    def test_changed_files_are_scanned_again(self):
+        cchecker.build_index(self.source_dir, self.cache_filename)
+        cchecker.save_caches()
+        self.write("lib.h", "int add_ints(int a, int b, int c);\n")
+        index = cchecker.build_index(self.source_dir, self.cache_filename)
+        self.assertEqual(index["add_ints"][0][2], ("a", "b", "c"))
+
+    def test_check_api_item(self):
+        cchecker._INDEXES[self.source_dir] = cchecker.build_index(self.source_dir, self.cache_filename)
+        cchecker.check_api_item("lib.add_ints", {"arguments" : ("int", "int")}, self.source_dir)
+        self.assertRaises(libvh.Mismatched_Api_Argument, cchecker.check_api_item,
+                          "lib.add_ints", {"arguments" : ("int", )}, self.source_dir)
+        self.assertRaises(libvh.Missing_Api_Functionality, cchecker.check_api_item,
+                          "lib.missing", {"arguments" : ()}, self.source_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "versionhelper"))
+
+import _apientry
+import _diff
+from _serialization import serialize, deserialize
+
+API = {"mod.f" : {"arguments" : ("naïve str", ), "keywords" : {"clé" : "été"}},
+       "mod.g" : {"arguments" : ("a", "b"), "returns" : ("int", )}}
+
+
+def _strings(data):
+    if isinstance(data, dict):
+        for key, value in data.items():
+            yield key
+            for item in _strings(value):
+                yield item
+    elif isinstance(data, (list, tuple)):
+        for item in data:
+            for string in _strings(item):
+                yield string
+    elif isinstance(data, basestring):
+        yield data
+
+
+class Test_Round_Trip(unittest.TestCase):
+
+    def test_non_ascii_api_is_read_back_unchanged(self):
+        self.assertEqual(deserialize(serialize(API)), API)
+
+    def test_strings_are_read_back_as_str(self):
+        api = {u"mod.h" : {u"arguments" : (u"na\xefve", ), u"keywords" : {u"cl\xe9" : [u"\xe9t\xe9"]}}}
+        stored = deserialize(serialize(api))
+        self.assertTrue(all(type(string) is str for string in _strings(stored)))
+        self.assertEqual(stored, {"mod.h" : {"arguments" : ("naïve", ), "keywords" : {"clé" : ("été", )}}})
+
+    def test_serialization_is_canonical(self):
+        self.assertEqual(serialize(deserialize(serialize(API))), serialize(API))
+
+
+class Test_Stored_Api_Comparison(unittest.TestCase):
+
+    def test_stored_entries_equal_the_api_file_entries(self):
+        self.assertEqual(_apientry.build_entries(deserialize(serialize(API))), _apientry.build_entries(API))
+
+    def test_unchanged_non_ascii_api_is_a_patch(self):
+        report = _diff.compare_apis(API, deserialize(serialize(API)))
+        self.assertEqual(report.change_type, "patch")
+        self.assertEqual(_diff.render_report(report), [])
+
+    def test_non_ascii_changes_are_rendered(self):
+        api = dict(API)
+        api["mod.f"] = {"arguments" : ("naïve str", ), "keywords" : {"clé" : "hiver"}, "returns" : ("ça", )}
+        report = _diff.compare_apis(api, deserialize(serialize(API)))
+        self.assertEqual(report.change_type, "major")
+        messages = '\n'.join(_diff.render_report(report))
+        self.assertIn("ça", messages)
+        self.assertIn("clé: été -> hiver", messages)
+
+
+if __name__ == "__main__":
+    unittest.main()
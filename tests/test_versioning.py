@@ -0,0 +1,114 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "versionhelper"))
+
+import _apifile
+import libvh
+
+API_FILE = '''VERSION = "1.0.0"
+PROJECT = "{}"
+LANGUAGE = "python"
+API = {}
+'''
+API = {"mod.f" : {"arguments" : ("a", )}}
+
+
+class Test_Versioning(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.api_filename = os.path.join(self.directory, "api.py")
+        self.project = "versioning_" + os.path.basename(self.directory)
+        self.write_api(API)
+        self.write_source("def f(a):\n    return a\n")
+        self.run_helper()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_api(self, api):
+        with open(self.api_filename, 'w') as _file:
+            _file.write(API_FILE.format(self.project, repr(api)))
+
+    def write_source(self, source):
+        with open(os.path.join(self.directory, "mod.py"), 'w') as _file:
+            _file.write(source)
+
+    def run_helper(self, **options):
+        options.setdefault("no_invariant_check", True)
+        libvh.version_helper(self.api_filename, self.directory, silent=True, rehash=True, **options)
+
+    def version(self):
+        return _apifile.load(self.api_filename).VERSION
+
+    def database(self):
+        return libvh._open_database(os.path.join(self.directory, "api.db"))
+
+    def stored_digest(self):
+        return libvh._stored_digest(self.database(), self.project)
+
+    def store_old_digest_format(self):
+        """Replaces the stored digest with one of an older digest format."""
+        db = self.database()
+        api = db.load_api_info(self.project)[1]
+        db.store_api_info(self.project, "0" * 64, api, None)
+
+    def test_source_change_bumps_patch_version(self):
+        self.write_source("def f(a):\n    return a + 1\n")
+        self.run_helper()
+        self.assertEqual(self.version(), "1.0.1")
+
+    def test_failed_changelog_write_does_not_bump(self):
+        digest = self.stored_digest()
+        self.write_source("def f(a):\n    return a + 1\n")
+        self.assertRaises(IOError, self.run_helper, changelog=os.path.join("nodir", "log.txt"))
+        self.assertEqual(self.version(), "1.0.0")
+        self.assertEqual(self.stored_digest(), digest)
+        self.run_helper()
+        self.assertEqual(self.version(), "1.0.1")
+
+    def test_concurrent_runs_bump_once(self):
+        self.write_source("def f(a):\n    return a + 1\n")
+        first, second = libvh.Session(no_invariant_check=True), libvh.Session(no_invariant_check=True)
+        plans = [session.plan(self.api_filename, self.directory) for session in (first, second)]
+        self.assertEqual([plan.new_version for plan in plans], ["1.0.1", "1.0.1"])
+        first.apply(plans[0])
+        self.assertRaises(libvh.Stale_Plan, second.apply, plans[1])
+        self.assertEqual(self.version(), "1.0.1")
+        self.run_helper()
+        self.assertEqual(self.version(), "1.0.1")
+
+    def check_rebaseline(self, **options):
+        self.store_old_digest_format()
+        self.run_helper(**options)
+        self.assertEqual(self.version(), "1.0.0")
+        self.assertEqual(self.database().load_api_info(self.project)[2], libvh.DIGEST_FORMAT)
+        self.assertNotEqual(self.stored_digest(), "0" * 64)
+
+    def test_old_digest_format_is_replaced_without_a_bump(self):
+        self.check_rebaseline()
+
+    def test_old_digest_format_is_replaced_without_a_bump_when_checking(self):
+        self.check_rebaseline(no_invariant_check=False, checker="astchecker")
+
+    def check_api_change_with_old_digest_format(self, **options):
+        with open(os.path.join(self.directory, "mod.py"), 'a') as _file:
+            _file.write("def g():\n    pass\n")
+        self.write_api(dict(API, **{"mod.g" : {"arguments" : ()}}))
+        self.store_old_digest_format()
+        self.run_helper(**options)
+        self.assertEqual(self.version(), "1.1.0")
+
+    def test_api_change_is_compared_with_old_digest_format(self):
+        self.check_api_change_with_old_digest_format()
+
+    def test_api_change_is_compared_with_old_digest_format_when_checking(self):
+        self.check_api_change_with_old_digest_format(no_invariant_check=False, checker="astchecker")
+
+
+if __name__ == "__main__":
+    unittest.main()
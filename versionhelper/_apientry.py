@@ -0,0 +1,154 @@
+"""A compact in-memory form of the entries of an API.
+
+   An API dictionary maps item names to dictionaries of values, and an API with 100k items holds
+   hundreds of thousands of small dictionaries, lists and duplicate strings (the deserialized API
+   from the database repeats every type string). An Api_Entry stores the values of one item in
+   two tuples instead: its fields (the keys), which are shared by every entry with the same
+   fields, and its values, with strings interned and lists turned into tuples. The hash of the
+   entry is computed once, so unchanged entries of two APIs are told apart from changed ones
+   without comparing their values."""
+import collections
+import gc
+
+_FIELDS = dict()
+
+
+class _Pairs(tuple):
+    """ The (key, value) pairs of a dictionary, sorted by key. """
+
+    __slots__ = ()
+
+
+class Api_Entry(object):
+    """ The values of one API item, read like the dictionary they were built from (a read-only mapping).
+
+        Dictionaries are returned for the dictionaries among the values (e.g. "keywords"), and tuples
+        for the lists. Entries compare equal when their values do. """
+
+    __slots__ = ("name", "fields", "_values", "hash")
+
+    def __init__(self, name, values):
+        self.name = _compact(name)
+        items = sorted([(_compact(key), _compact(value)) for key, value in values.iteritems()])
+        fields = tuple([key for key, _ in items])
+        self.fields = _FIELDS.setdefault(fields, fields)
+        self._values = tuple([value for _, value in items])
+        self.hash = _hash(self.fields, self._values)
+
+    def get(self, key, default=None):
+        if key in self.fields:
+            return _expand(self._values[self.fields.index(key)])
+        return default
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return _expand(self._values[self.fields.index(key)])
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self.fields
+
+    def __iter__(self):
+        return iter(self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def keys(self):
+        return list(self.fields)
+
+    def values(self):
+        return [_expand(value) for value in self._values]
+
+    def items(self):
+        return [(key, _expand(value)) for key, value in zip(self.fields, self._values)]
+
+    def iterkeys(self):
+        return iter(self.fields)
+
+    def itervalues(self):
+        return (_expand(value) for value in self._values)
+
+    def iteritems(self):
+        return ((key, _expand(value)) for key, value in zip(self.fields, self._values))
+
+    def to_dict(self):
+        """Returns the values as a dictionary, as they would be read from the api file."""
+        return dict(self.items())
+
+    def __eq__(self, other):
+        if not isinstance(other, Api_Entry):
+            return NotImplemented
+        return self.hash == other.hash and self.fields == other.fields and self._values == other._values
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __hash__(self):
+        return self.hash
+
+    def __getstate__(self):
+        return self.name, self.fields, self._values
+
+    def __setstate__(self, state): # the hash is computed again, in case hashes differ between processes
+        self.name, fields, self._values = state
+        self.fields = _FIELDS.setdefault(fields, fields)
+        self.hash = _hash(self.fields, self._values)
+
+    def __repr__(self):
+        return "Api_Entry({!r}, {!r})".format(self.name, self.to_dict())
+
+collections.Mapping.register(Api_Entry)
+
+
+def build_entries(api):
+    """Returns a dictionary mapping each item name of api to an Api_Entry of its values.
+
+       Values that are already Api_Entry instances are used as they are."""
+    entries = dict()
+    enabled = gc.isenabled()
+    gc.disable() # entries never form reference cycles, so collecting while they are built is wasted work
+    try:
+        for name, values in api.iteritems():
+            if not isinstance(values, Api_Entry):
+                values = Api_Entry(name, values)
+            entries[values.name] = values
+    finally:
+        if enabled:
+            gc.enable()
+    return entries
+
+def to_api(entries):
+    """Returns the API dictionary that entries (returned by build_entries) were built from."""
+    return dict((name, entry.to_dict()) for name, entry in entries.iteritems())
+
+def _hash(fields, values):
+    try:
+        return hash((fields, values))
+    except TypeError: # e.g. objects created by an api file that had to be executed
+        return 0
+
+def _compact(value):
+    value_type = type(value)
+    if value_type is str:
+        return intern(value)
+    elif value_type is unicode: # compared with the UTF-8 str that deserialize returns
+        return intern(value.encode("utf-8"))
+    elif value_type is tuple or value_type is list: # strings, the most common items, are handled inline
+        return tuple([intern(item) if type(item) is str else _compact(item) for item in value])
+    elif value_type is dict:
+        return _Pairs(sorted([(intern(key) if type(key) is str else _compact(key),
+                               intern(item) if type(item) is str else _compact(item)) for
+                              key, item in value.iteritems()]))
+    elif value_type is set or value_type is frozenset:
+        return frozenset([_compact(item) for item in value])
+    return value
+
+def _expand(value):
+    value_type = type(value)
+    if value_type is _Pairs:
+        return dict((key, _expand(item)) for key, item in value)
+    elif value_type is tuple and value:
+        return tuple(_expand(item) for item in value)
+    return value
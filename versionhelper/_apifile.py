@@ -0,0 +1,215 @@
+"""Reading and updating api files without executing them.
+
+   The assignments at the top level of an api file are evaluated from its syntax tree: literals,
+   names assigned earlier in the file, unary minus and + (e.g. the `_p + "name"` prefix idiom) are
+   supported. An api file that uses anything else (imports, calls, loops, ...) is executed instead.
+   The VERSION of an api file is updated by replacing only the bytes of its string literal, and the
+   file is replaced atomically."""
+import ast
+import os
+import re
+import shutil
+import tempfile
+import tokenize
+import types
+import StringIO
+
+import _timing
+
+_ASSIGNMENT = re.compile(r"VERSION[ \t]*=[ \t]*$")
+_SPANS = dict()
+
+
+class Not_Literal(Exception):
+    """ Raised when an api file cannot be evaluated without executing it. """
+
+
+def load(filename):
+    """Returns a module object with the names assigned in the api file filename."""
+    with open(filename, 'r') as _file:
+        source = _file.read()
+    return load_source(source, filename)
+
+def load_source(source, filename):
+    """Returns a module object with the names assigned in source, the contents of the api file filename.
+
+       source is only executed if evaluate cannot handle it."""
+    module = types.ModuleType("api")
+    try:
+        namespace, span = evaluate(source, filename)
+    except Not_Literal:
+        _timing.count("api_files_executed")
+        exec compile(source, filename, "exec") in module.__dict__
+        _SPANS.pop(filename, None)
+    else:
+        module.__dict__.update(namespace)
+        _SPANS[filename] = span
+    module.__file__ = filename
+    return module
+
+def evaluate(source, filename=''):
+    """Returns a dictionary of the names assigned at the top level of source, and the span of the VERSION literal.
+
+       The span is the (start, end) byte offsets of the string literal of the last `VERSION = "..."`
+       assignment, or None if VERSION is not assigned a single string literal.
+       Raises Not_Literal if source does anything else than assign literal values to names."""
+    tree = ast.parse(source, filename)
+    namespace = dict()
+    version_node = None
+    for statement in tree.body:
+        if isinstance(statement, ast.Assign):
+            value = _evaluate(statement.value, namespace)
+            for target in statement.targets:
+                _assign(target, value, namespace)
+            if any(isinstance(target, ast.Name) and target.id == "VERSION" for target in statement.targets):
+                version_node = statement if len(statement.targets) == 1 else None
+        elif not (isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Str)): # docstring
+            raise Not_Literal("Unable to evaluate line {} of {}".format(statement.lineno, filename))
+    span = None
+    if version_node is not None and isinstance(version_node.value, ast.Str):
+        span = _literal_span(source, version_node.value, namespace["VERSION"])
+    return namespace, span
+
+def _evaluate(node, namespace):
+    node_type = type(node)
+    if node_type is ast.Str:
+        return _intern(node.s)
+    elif node_type is ast.Dict:
+        return dict(zip(_evaluate_all(node.keys, namespace), _evaluate_all(node.values, namespace)))
+    elif node_type is ast.Tuple:
+        return tuple(_evaluate_all(node.elts, namespace))
+    elif node_type is ast.Name:
+        try:
+            return namespace[node.id]
+        except KeyError:
+            pass
+        try:
+            return {"True" : True, "False" : False, "None" : None}[node.id]
+        except KeyError:
+            raise Not_Literal("Unable to evaluate name '{}' on line {}".format(node.id, node.lineno))
+    elif node_type is ast.Num:
+        return node.n
+    elif node_type is ast.List:
+        return _evaluate_all(node.elts, namespace)
+    elif node_type is ast.Set:
+        return set(_evaluate_all(node.elts, namespace))
+    elif node_type is ast.BinOp and type(node.op) is ast.Add:
+        try:
+            return _evaluate(node.left, namespace) + _evaluate(node.right, namespace)
+        except TypeError: # let exec raise the error
+            pass
+    elif node_type is ast.UnaryOp and type(node.op) is ast.USub:
+        operand = _evaluate(node.operand, namespace)
+        if isinstance(operand, (int, long, float, complex)):
+            return -operand
+    raise Not_Literal("Unable to evaluate the expression on line {}".format(node.lineno))
+
+def _evaluate_all(nodes, namespace):
+    """Returns a list of the values of nodes; string literals, the most common nodes, are handled inline."""
+    return [_intern(node.s) if type(node) is ast.Str else _evaluate(node, namespace) for node in nodes]
+
+def _intern(string):
+    """Returns the interned copy of string, so that the names and types repeated throughout an API are stored once."""
+    return intern(string) if type(string) is str else string
+
+def _assign(target, value, namespace):
+    if isinstance(target, ast.Name):
+        namespace[target.id] = value
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        try:
+            values = list(value)
+        except TypeError:
+            raise Not_Literal("Unable to unpack the value on line {}".format(target.lineno))
+        if len(values) != len(target.elts):
+            raise Not_Literal("Unable to unpack the value on line {}".format(target.lineno))
+        for item, item_value in zip(target.elts, values):
+            _assign(item, item_value, namespace)
+    else:
+        raise Not_Literal("Unable to assign to the target on line {}".format(target.lineno))
+
+def _literal_span(source, node, value):
+    """Returns the (start, end) byte offsets of the string literal node in source, or None if they cannot be determined."""
+    if node.col_offset < 0: # multi-line strings do not record where they start
+        return None
+    start = 0
+    for _ in range(node.lineno - 1):
+        start = source.index('\n', start) + 1
+    start += node.col_offset
+    try:
+        token = next(tokenize.generate_tokens(StringIO.StringIO(source[start:]).readline))
+    except (tokenize.TokenError, StopIteration):
+        return None
+    end = start + len(token[1])
+    if token[0] != tokenize.STRING or source[start:end] != token[1] or not _holds(source, (start, end), value):
+        return None # e.g. implicitly concatenated strings
+    return start, end
+
+def _holds(source, span, value):
+    """Returns True if span is the string literal of a `VERSION = ` assignment in source whose value is value."""
+    start, end = span
+    line_start = source.rfind('\n', 0, start) + 1
+    if not _ASSIGNMENT.match(source, line_start, start):
+        return False
+    try:
+        return ast.literal_eval(source[start:end]) == value
+    except (SyntaxError, ValueError):
+        return False
+
+def write_version(filename, current_version, new_version):
+    """Replaces the VERSION string literal of the api file filename, which should be current_version, with new_version.
+
+       The span of the literal found by the last load of filename is used if the file still holds
+       current_version there; otherwise the file is parsed again. If the literal cannot be found,
+       the first `VERSION = "current_version"` in the file is replaced."""
+    if current_version != new_version:
+        replace_file(filename, patch_version(filename, current_version, new_version))
+
+def patch_version(filename, current_version, new_version):
+    """Returns the contents of the api file filename with the VERSION literal replaced as write_version does; nothing is written."""
+    with open(filename, "rb") as _file:
+        source = _file.read()
+    if current_version == new_version:
+        return source
+    span = _SPANS.get(filename)
+    if span is None or not _holds(source, span, current_version):
+        try:
+            span = evaluate(source, filename)[1]
+        except (Not_Literal, SyntaxError):
+            span = None
+    if span is None:
+        return source.replace("VERSION = \"{}\"".format(current_version),
+                              "VERSION = \"{}\"".format(new_version), 1)
+    start, end = span
+    literal = source[start:end]
+    prefix_length = len(literal) - len(literal.lstrip("uUbBrR"))
+    quote = literal[prefix_length:prefix_length + 3]
+    if quote not in ('"""', "'''"):
+        quote = quote[0]
+    new_literal = literal[:prefix_length] + quote + new_version + quote
+    _SPANS[filename] = (start, start + len(new_literal)) # checked with _holds before it is used
+    return source[:start] + new_literal + source[end:]
+
+def replace_file(filename, data):
+    """Atomically replaces the contents of filename with data.
+
+       data is written to a temporary file in the same directory, which is then renamed over
+       filename (or the file that filename links to). The permissions of filename are kept."""
+    filename = os.path.realpath(filename)
+    descriptor, temporary_name = tempfile.mkstemp(prefix='.' + os.path.basename(filename),
+                                                  dir=os.path.dirname(filename))
+    try:
+        with os.fdopen(descriptor, "wb") as _file:
+            _file.write(data)
+            _file.flush()
+            os.fsync(_file.fileno())
+        if os.path.exists(filename):
+            shutil.copymode(filename, temporary_name)
+        try:
+            os.rename(temporary_name, filename)
+        except OSError: # windows does not replace existing files
+            os.remove(filename)
+            os.rename(temporary_name, filename)
+    except:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+        raise
@@ -1,13 +1,293 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import signal
+
 import libvh
+import _apientry
+import _digest
+import _walker
+from _serialization import serialize
 
-def check_api_items(api, source_dir, checkers):
-    for item, values in api.items():
-        for checker in checkers:
-            try:
-                checker.check_api_item(item, values, source_dir)
-            except (libvh.Missing_Api_Functionality, libvh.Mismatched_Api_Argument):
-                continue
-            else:
-                break
+_SEPARATORS = re.compile(r"[.:/]")
+
+class Check_Timeout(Exception):
+    """ Raised inside a worker process when checking an API item takes longer than the timeout. """
+
+
+class Check_Cache(object):
+    """ The results of earlier successful checks, stored in the Check_Cache table of an API_Database.
+
+        Entries are kept per project and per (absolute) source directory. An entry is reused while
+        the API entry, the checkers and the blob ids of the files that the accepting checker
+        reported for the item are all unchanged.
+        If force is True, no entry is reused, but the results are still stored. """
+
+    def __init__(self, db, checkers, project, source_dir, dry_run=False, force=False):
+        self.db = db
+        self.project = project
+        self.source_dir = os.path.abspath(source_dir)
+        self.dry_run = dry_run
+        self.force = force
+        self.checker_names = libvh._checker_names(checkers)
+        self.entries = dict() if force else db.load_check_cache(project, self.source_dir)
+        self.updates = []
+        self.digest_updates = []
+
+    def unchecked_items(self, api):
+        """Returns a dictionary of the items in api that have no valid cache entry."""
+        if self.force:
+            return dict(api)
+        candidates = dict()
+        for item, values in api.iteritems():
+            entry = self.entries.get(item)
+            if entry is not None and entry[0] == self.checker_names and entry[1] == _entry_hash(values):
+                candidates[item] = entry[2]
+        filenames = sorted(set(filename for files in candidates.values() for filename, _ in files))
+        digests = self._file_digests(filenames)
+        unchecked = dict()
+        for item, values in api.iteritems():
+            files = candidates.get(item)
+            if files is None or any(digests.get(filename) != digest for filename, digest in files):
+                unchecked[item] = values
+        return unchecked
+
+    def record(self, item, values, filenames, signature):
+        self.updates.append((item, values, filenames, signature))
+
+    def save(self):
+        """Stores the recorded results in the database, unless dry_run is True."""
+        if self.dry_run:
+            return
+        rows, digest_updates = self.pending_rows()
+        if digest_updates:
+            self.db.store_file_digests(digest_updates)
+        if rows:
+            self.db.store_check_cache(rows)
+
+    def pending_rows(self):
+        """Returns the rows for the Check_Cache table and the entries for the File_Digest table that save
+           would store, and forgets them."""
+        digests = self._file_digests(sorted(set(filename for _, _, filenames, _ in self.updates
+                                                for filename in filenames)))
+        rows = []
+        for item, values, filenames, signature in self.updates:
+            if all(filename in digests for filename in filenames):
+                files = [(filename, digests[filename]) for filename in sorted(set(filenames))]
+                rows.append((self.project, self.source_dir, item, self.checker_names,
+                             _entry_hash(values), files, signature))
+        self.updates = []
+        digest_updates, self.digest_updates = self.digest_updates, []
+        return rows, digest_updates
+
+    def _file_digests(self, filenames):
+        """Returns a dictionary mapping filename -> blob id for the filenames that exist."""
+        filenames = [filename for filename in filenames if os.path.isfile(filename)]
+        digests, updates = _digest.obtain_file_digests(filenames, self.db.load_file_digests())
+        self.digest_updates.extend(updates)
+        return dict(zip(filenames, digests))
+
+
+class Checker_Router(object):
+    """ Sends each API item straight to the checkers that handle it, instead of trying every checker.
+
+        A checker module may declare what it handles with the module attributes MODULE_PREFIXES
+        (dotted names, e.g. ("mypackage.native", )), SOURCE_EXTENSIONS (e.g. (".py", )) and
+        LANGUAGES (e.g. ("python", ); used for the extensions in libvh.SOURCE_TYPE when
+        SOURCE_EXTENSIONS is not declared). An item belongs to the checkers of the longest module
+        prefix it starts with; otherwise, to the checkers of the extension of the source file that
+        defines the longest module path of the item (e.g. "package/module.py" for
+        "package.module.function"). The source files are listed once, when they are first needed.
+        Items that belong to no checker are tried with the checkers that declare nothing, then
+        with the others. A single checker handles every item. """
+
+    def __init__(self, checkers, source_dir):
+        self.checkers = list(checkers)
+        self.source_dir = source_dir
+        self.prefixes = dict()
+        self.extensions = dict()
+        undeclared = []
+        for checker in self.checkers:
+            prefixes = getattr(checker, "MODULE_PREFIXES", ())
+            extensions = _declared_extensions(checker)
+            for prefix in prefixes:
+                self.prefixes.setdefault(prefix, []).append(checker)
+            for extension in extensions:
+                self.extensions.setdefault(extension, []).append(checker)
+            if not (prefixes or extensions):
+                undeclared.append(checker)
+        self.fallback = undeclared + [checker for checker in self.checkers if checker not in undeclared]
+        self.modules = None
+
+    def route(self, item):
+        """Returns the checkers to try for item, and whether they are the checkers that item belongs to."""
+        if len(self.checkers) == 1:
+            return self.checkers, True
+        segments = _SEPARATORS.split(item)
+        for index in range(len(segments) - 1, 0, -1):
+            checkers = self.prefixes.get('.'.join(segments[:index]))
+            if checkers is not None:
+                return checkers, True
+        if self.extensions:
+            if self.modules is None:
+                self.modules = _index_modules(self.source_dir, self.extensions)
+            for index in range(len(segments) - 1, 0, -1):
+                extension = self.modules.get('/'.join(segments[:index]))
+                if extension is not None:
+                    return self.extensions[extension], True
+        return self.fallback, False
+
+
+def _declared_extensions(checker):
+    extensions = getattr(checker, "SOURCE_EXTENSIONS", None)
+    if extensions is None:
+        extensions = ['.' + source_type for language in getattr(checker, "LANGUAGES", ()) for
+                      source_type in libvh.SOURCE_TYPE.get(language, ())]
+    return tuple(extensions)
+
+def _index_modules(source_dir, extensions):
+    """Returns a dictionary mapping module path (e.g. "package/module") -> extension for the source files beneath source_dir.
+
+       If source_dir is itself a package, its modules are also indexed under the package name."""
+    filenames = _walker.walk(source_dir, lambda name: os.path.splitext(name)[1] in extensions)
+    root = os.path.abspath(source_dir)
+    prefixes = ['']
+    if os.path.isfile(os.path.join(root, "__init__.py")):
+        prefixes.append(os.path.basename(root) + '/')
+    modules = dict()
+    for filename in filenames:
+        path, extension = os.path.splitext(os.path.relpath(filename, root).replace(os.sep, '/'))
+        if path.endswith("/__init__"):
+            path = path[:-len("/__init__")]
+        for prefix in prefixes:
+            modules.setdefault(prefix + path, extension)
+    return modules
+
+def _entry_hash(values):
+    if isinstance(values, _apientry.Api_Entry):
+        values = values.to_dict() # serialized exactly like the dictionary it was built from
+    return hashlib.sha256(serialize(values)).hexdigest()
+
+def check_api_items(api, source_dir, checkers, processes=1, timeout=0, cache=None, router=None):
+    """Runs the checkers against every item in api; an item passes when one of the checkers it is routed to accepts it.
+
+       If processes is greater than 1, the items are grouped by module and checked in a pool
+       of worker processes. Every failing item is then reported instead of only the first one,
+       and timeout (in seconds, 0 for no limit) bounds the time spent on each item.
+       If cache (a Check_Cache) is supplied, items it holds a valid result for are not checked,
+       and the items that pass are added to it. router (a Checker_Router for checkers and source_dir)
+       is created if it is not supplied. Returns the number of items that were checked."""
+    if cache is not None:
+        api = cache.unchecked_items(api)
+    if router is None:
+        router = Checker_Router(checkers, source_dir)
+    try:
+        if processes > 1 and not multiprocessing.current_process().daemon:
+            _check_in_pool(api, source_dir, router, processes, timeout, cache)
         else:
-            raise
+            for item, values in api.items():
+                candidates, claimed = router.route(item)
+                checker = _check_item(item, values, source_dir, candidates, claimed)
+                if cache is not None:
+                    _record(cache, checker, item, values, source_dir)
+    finally:
+        if cache is not None:
+            cache.save()
+    return len(api)
+
+def _record(cache, checker, item, values, source_dir):
+    describe = getattr(checker, "describe_api_item", None)
+    if describe is not None:
+        filenames, signature = describe(item, source_dir)
+        cache.record(item, values, filenames, signature)
+
+def _check_item(item, values, source_dir, checkers, claimed=True, timeout=0):
+    """Returns the first of checkers that accepts item.
+
+       If none do, the error of the first checker is raised if item belongs to the checkers (claimed
+       is True) or one of them found a mismatch; otherwise, Missing_Api_Functionality is raised."""
+    errors = []
+    for checker in checkers:
+        try:
+            _call_with_timeout(timeout, checker.check_api_item, item, values, source_dir)
+        except (libvh.Missing_Api_Functionality, libvh.Mismatched_Api_Argument) as error:
+            errors.append((checker, error))
+        else:
+            return checker
+    if not errors:
+        raise libvh.Missing_Api_Functionality("No invariant checker handles {}; no checkers were selected".format(item))
+    mismatches = [error for _, error in errors if isinstance(error, libvh.Mismatched_Api_Argument)]
+    if claimed or mismatches:
+        raise (mismatches or [errors[0][1]])[0]
+    message = ["No invariant checker handles {}; it is not under the MODULE_PREFIXES or in a file with "
+               "the SOURCE_EXTENSIONS of any checker, and no checker located it:".format(item)]
+    message.extend("    {}: {}".format(libvh._checker_name(checker), str(error).strip()) for checker, error in errors)
+    raise libvh.Missing_Api_Functionality("\n".join(message))
+
+def _call_with_timeout(timeout, function, *args):
+    if not timeout or not hasattr(signal, "setitimer"):
+        return function(*args)
+    def _alarm(signal_number, frame):
+        raise Check_Timeout("Timed out after {} seconds".format(timeout))
+    previous_handler = signal.signal(signal.SIGALRM, _alarm)
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return function(*args)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+
+def _check_in_pool(api, source_dir, router, processes, timeout, cache=None):
+    checkers = router.checkers
+    groups = dict()
+    for item, values in api.items():
+        candidates, claimed = router.route(item)
+        route = (tuple(checkers.index(checker) for checker in candidates), claimed)
+        groups.setdefault(item.rsplit('.', 1)[0], []).append((item, values, route))
+    checker_names = [libvh._checker_name(checker) for checker in checkers]
+    # a new worker for every group, so that modules imported (and state left behind) by the checkers
+    # while checking one module cannot change the results for the next one
+    pool = multiprocessing.Pool(min(processes, len(groups) or 1), maxtasksperchild=1)
+    try:
+        results = [(items, pool.apply_async(_check_group, (items, source_dir, checker_names, timeout,
+                                                           cache is not None)))
+                   for items in groups.values()]
+        failures = []
+        for items, result in results:
+            try: # backstop for workers that are stuck where the alarm cannot interrupt them
+                group_failures, descriptions = result.get(timeout * len(items) + 5 if timeout else None)
+                failures.extend(group_failures)
+                for item, values, filenames, signature in descriptions:
+                    cache.record(item, values, filenames, signature)
+            except multiprocessing.TimeoutError:
+                failures.extend((item, "Check_Timeout", "Check_Timeout: Timed out")
+                                for item, _, _ in items)
+    finally:
+        pool.terminate()
+        pool.join()
+
+    if failures:
+        failures.sort()
+        message = "\n".join("{}: {}".format(item, message) for item, _, message in failures)
+        if all(error == "Missing_Api_Functionality" for _, error, _ in failures):
+            raise libvh.Missing_Api_Functionality(message)
+        raise libvh.Mismatched_Api_Argument(message)
+
+def _check_group(items, source_dir, checker_names, timeout, describe=False):
+    """Returns the failures and, if describe is True, the descriptions of the items that passed.
+
+       items are (item, values, (checker indices, claimed)) as routed by the parent process."""
+    checkers = [libvh._load_checker(name) for name in checker_names]
+    failures = []
+    descriptions = []
+    for item, values, (indices, claimed) in items:
+        try:
+            checker = _check_item(item, values, source_dir, [checkers[index] for index in indices],
+                                  claimed, timeout)
+            if describe and hasattr(checker, "describe_api_item"):
+                descriptions.append((item, values) + tuple(checker.describe_api_item(item, source_dir)))
+        except Exception as error:
+            name = type(error).__name__
+            failures.append((item, name, "{}: {}".format(name, str(error).strip())))
+    return failures, descriptions
@@ -1,8 +1,275 @@
-import pride.components.database
+import contextlib
+import hashlib
+import time
+import zlib
+import sqlite3
 
-class API_Database(pride.components.database.Database):
+import _pride
+from _serialization import serialize, deserialize
+
+pride_database = _pride.import_module("pride.components.database")
+
+MAX_DELTA_CHAIN = 16
+BUSY_TIMEOUT = 10.0 # seconds sqlite waits for a lock held by another connection
+BUSY_RETRIES = 5 # times a transaction is retried after the busy timeout expires
+
+class API_Database(pride_database.Database):
 
     schema = {"Api_Info" : ("project TEXT PRIMARY_KEY UNIQUE",
-                            "digest BLOB", "api BLOB")}
-    primary_key = {"Api_Info" : "project"}
+                            "digest BLOB", "api BLOB", "digest_format INTEGER"),
+              "File_Digest" : ("filename TEXT PRIMARY_KEY UNIQUE",
+                               "size INTEGER", "mtime_ns INTEGER",
+                               "inode INTEGER", "digest TEXT"),
+              "Api_History" : ("project TEXT", "version TEXT", "timestamp REAL",
+                               "digest BLOB", "snapshot TEXT"),
+              "Api_Snapshot" : ("snapshot TEXT PRIMARY_KEY UNIQUE", "base TEXT",
+                                "depth INTEGER", "data BLOB"),
+              "Tree_Node" : ("digest TEXT PRIMARY_KEY UNIQUE", "entries BLOB"),
+              "Api_Tree" : ("project TEXT PRIMARY_KEY UNIQUE", "tree TEXT"),
+              "Check_Cache" : ("project TEXT", "directory TEXT", "item TEXT", "checkers TEXT",
+                               "entry TEXT", "files BLOB", "signature TEXT",
+                               "UNIQUE (project, directory, item)"),
+              "Check_Status" : ("project TEXT PRIMARY_KEY UNIQUE", "digest TEXT",
+                                "checkers TEXT")}
+    primary_key = {"Api_Info" : "project", "File_Digest" : "filename",
+                   "Api_Snapshot" : "snapshot", "Tree_Node" : "digest",
+                   "Api_Tree" : "project", "Check_Status" : "project"}
+    indices = {"Api_History_Version" : "Api_History (project, version)",
+               "Api_History_Digest" : "Api_History (digest)",
+               "Api_History_Timestamp" : "Api_History (project, timestamp)"}
     defaults = {"database_name" : "api.db"}
+    _file_digests = None
+    _depth = 0
+
+    def __init__(self, **kwargs):
+        super(API_Database, self).__init__(**kwargs)
+        # statements outside of transaction() are committed as they are executed; in WAL mode,
+        # readers see the last committed state and are not blocked by the writer (or block it)
+        self.connection.isolation_level = None
+        self.connection.execute("PRAGMA busy_timeout = {}".format(int(BUSY_TIMEOUT * 1000)))
+        _retry(self.connection.execute, "PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(Api_Info)")]
+        if "digest_format" not in columns: # created by an older version; its digests have no format (NULL)
+            with self.transaction():
+                self.connection.execute("ALTER TABLE Api_Info ADD COLUMN digest_format INTEGER")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(Check_Cache)")]
+        if "directory" not in columns: # created by an older version, keyed by item only; the results are discarded
+            with self.transaction():
+                self.connection.execute("DROP TABLE Check_Cache")
+                self.connection.execute("CREATE TABLE Check_Cache ({})".format(", ".join(self.schema["Check_Cache"])))
+        # the write lock is only taken if an index is missing, so opening an existing database does not wait for a writer
+        existing = set(row[0] for row in self.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+        missing = [name for name in sorted(self.indices) if name not in existing]
+        if missing:
+            with self.transaction():
+                for name in missing:
+                    self.connection.execute("CREATE INDEX IF NOT EXISTS {} ON {}".format(name, self.indices[name]))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Executes the enclosed block in one immediate transaction, which is committed when the block exits.
+
+           The write lock is taken when the block is entered, so the rows read inside of it cannot be
+           changed by another connection before the commit. If the lock is held by another connection,
+           it is waited for for up to BUSY_TIMEOUT seconds, BUSY_RETRIES times.
+           The transaction is rolled back if the block raises an exception.
+           Nested transaction blocks are part of the outermost one."""
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        _retry(self.connection.execute, "BEGIN IMMEDIATE")
+        self._depth = 1
+        try:
+            yield
+        except:
+            self._depth = 0
+            self.connection.rollback()
+            raise
+        self._depth = 0
+        try:
+            _retry(self.connection.commit)
+        except:
+            self.connection.rollback()
+            raise
+
+    def load_api_info(self, project):
+        """Returns (digest, api, digest_format) of the Api_Info row of project, or None.
+
+           digest_format identifies how digest was computed; it is None for rows written by older versions."""
+        row = self.connection.execute("SELECT digest, api, digest_format FROM Api_Info WHERE project = ?",
+                                      (project, )).fetchone()
+        return None if row is None else tuple(row)
+
+    def store_api_info(self, project, digest, api, digest_format):
+        """Inserts or replaces the Api_Info row of project."""
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO Api_Info VALUES (?, ?, ?, ?)",
+                                    (project, digest, api, digest_format))
+
+    def load_file_digests(self):
+        """Returns a dictionary mapping filename -> (size, mtime_ns, inode, digest).
+
+           The table is only read once per connection; the dictionary is kept up to date by store_file_digests."""
+        if self._file_digests is None:
+            cursor = self.connection.execute("SELECT filename, size, mtime_ns, inode, digest FROM File_Digest")
+            self._file_digests = dict((row[0], tuple(row[1:])) for row in cursor)
+        return self._file_digests
+
+    def store_file_digests(self, entries, removed=tuple()):
+        """Inserts or replaces (filename, size, mtime_ns, inode, digest) entries and deletes the removed filenames."""
+        with self.transaction():
+            self.connection.executemany("INSERT OR REPLACE INTO File_Digest VALUES (?, ?, ?, ?, ?)", entries)
+            self.connection.executemany("DELETE FROM File_Digest WHERE filename = ?",
+                                        ((filename, ) for filename in removed))
+        if self._file_digests is not None:
+            for entry in entries:
+                self._file_digests[entry[0]] = tuple(entry[1:])
+            for filename in removed:
+                self._file_digests.pop(filename, None)
+
+    def load_check_cache(self, project, directory):
+        """Returns a dictionary mapping API item -> (checkers, entry hash, [(filename, blob id), ...], signature)
+           for the items of project that were checked against the source in directory."""
+        cursor = self.connection.execute("SELECT item, checkers, entry, files, signature FROM Check_Cache "
+                                         "WHERE project = ? AND directory = ?", (project, directory))
+        return dict((row[0], (row[1], row[2], deserialize(row[3]), row[4])) for row in cursor)
+
+    def store_check_cache(self, rows):
+        """Inserts or replaces (project, directory, item, checkers, entry hash, [(filename, blob id), ...],
+           signature) rows."""
+        with self.transaction():
+            self.connection.executemany("INSERT OR REPLACE INTO Check_Cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                        ((project, directory, item, checkers, entry, serialize(files), signature) for
+                                         project, directory, item, checkers, entry, files, signature in rows))
+
+    def load_check_status(self, project):
+        """Returns (digest, checkers) of the last run of the invariant checker that passed for project, or None."""
+        row = self.connection.execute("SELECT digest, checkers FROM Check_Status WHERE project = ?",
+                                      (project, )).fetchone()
+        return None if row is None else tuple(row)
+
+    def store_check_status(self, project, digest, checkers):
+        """Records that the invariant checkers named by checkers passed for project at digest."""
+        with self.transaction():
+            self.connection.execute("INSERT OR REPLACE INTO Check_Status VALUES (?, ?, ?)",
+                                    (project, digest, checkers))
+
+    def record_version(self, project, version, digest, api, timestamp=None):
+        """Adds a row for version to Api_History and stores a snapshot of api.
+
+           Returns the id of the snapshot."""
+        with self.transaction():
+            previous = self.connection.execute("SELECT snapshot FROM Api_History WHERE project = ? "
+                                               "ORDER BY timestamp DESC, rowid DESC LIMIT 1",
+                                               (project, )).fetchone()
+            snapshot = self.store_snapshot(api, previous[0] if previous else None)
+            self.connection.execute("INSERT INTO Api_History VALUES (?, ?, ?, ?, ?)",
+                                    (project, version, time.time() if timestamp is None else timestamp,
+                                     digest, snapshot))
+        return snapshot
+
+    def store_snapshot(self, api, base=None):
+        """Stores api under the sha256 of its serialized form, unless it is already present, and returns that id.
+
+           If base names an existing snapshot, only the entries that differ from it are stored.
+           A full copy is stored instead once the chain of deltas reaches MAX_DELTA_CHAIN."""
+        serialized = serialize(api)
+        snapshot = hashlib.sha256(serialized).hexdigest()
+        if self._snapshot_row(snapshot) is not None:
+            return snapshot
+        depth = 0
+        if base is not None:
+            row = self._snapshot_row(base)
+            if row is not None and row[1] < MAX_DELTA_CHAIN:
+                depth = row[1] + 1
+                old_api = self.load_snapshot(base)
+                changed = dict((name, values) for name, values in api.iteritems() if
+                               old_api.get(name) != values)
+                removed = sorted(name for name in old_api if name not in api)
+                serialized = serialize({"set" : changed, "removed" : removed})
+        with self.transaction():
+            self.connection.execute("INSERT OR IGNORE INTO Api_Snapshot VALUES (?, ?, ?, ?)",
+                                    (snapshot, base if depth else None, depth,
+                                     sqlite3.Binary(zlib.compress(serialized, 9))))
+        return snapshot
+
+    def load_snapshot(self, snapshot):
+        """Returns the api stored under the snapshot id; Raises KeyError if there is no such snapshot."""
+        deltas = []
+        while True:
+            row = self._snapshot_row(snapshot)
+            if row is None:
+                raise KeyError(snapshot)
+            base, _, data = row
+            data = deserialize(zlib.decompress(str(data)))
+            if base is None:
+                break
+            deltas.append(data)
+            snapshot = base
+        api = data
+        for delta in reversed(deltas):
+            api.update(delta["set"])
+            for name in delta["removed"]:
+                del api[name]
+        return api
+
+    def _snapshot_row(self, snapshot):
+        return self.connection.execute("SELECT base, depth, data FROM Api_Snapshot WHERE snapshot = ?",
+                                       (snapshot, )).fetchone()
+
+    def store_tree(self, project, root, nodes):
+        """Stores the source tree nodes that are not already present and makes root the tree of project."""
+        with self.transaction():
+            self.connection.executemany("INSERT OR IGNORE INTO Tree_Node VALUES (?, ?)",
+                                        ((digest, serialize(entries)) for digest, entries in nodes.iteritems()))
+            self.connection.execute("INSERT OR REPLACE INTO Api_Tree VALUES (?, ?)", (project, root))
+
+    def load_tree_root(self, project):
+        """Returns the root digest of the source tree last stored for project, or None."""
+        row = self.connection.execute("SELECT tree FROM Api_Tree WHERE project = ?", (project, )).fetchone()
+        return row[0] if row else None
+
+    def load_tree_node(self, digest):
+        """Returns the entries of the source tree node digest; Raises KeyError if it is not stored."""
+        row = self.connection.execute("SELECT entries FROM Tree_Node WHERE digest = ?", (digest, )).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return deserialize(row[0])
+
+    def load_history(self, project):
+        """Returns a list of (version, timestamp, digest, snapshot) for project, oldest first."""
+        return self.connection.execute("SELECT version, timestamp, digest, snapshot FROM Api_History "
+                                       "WHERE project = ? ORDER BY timestamp, rowid",
+                                       (project, )).fetchall()
+
+    def find_version(self, project, version):
+        """Returns the api recorded for version of project, or None if that version was never recorded."""
+        row = self.connection.execute("SELECT snapshot FROM Api_History WHERE project = ? AND version = ? "
+                                      "ORDER BY timestamp DESC, rowid DESC LIMIT 1",
+                                      (project, version)).fetchone()
+        return self.load_snapshot(row[0]) if row else None
+
+    def find_digest(self, digest):
+        """Returns (project, version, api) for the most recent release with the package digest, or None."""
+        row = self.connection.execute("SELECT project, version, snapshot FROM Api_History WHERE digest = ? "
+                                      "ORDER BY timestamp DESC, rowid DESC LIMIT 1",
+                                      (digest, )).fetchone()
+        return (row[0], row[1], self.load_snapshot(row[2])) if row else None
+
+
+def _retry(function, *args):
+    """Calls function(*args), retrying up to BUSY_RETRIES times while the database is locked."""
+    for attempt in range(BUSY_RETRIES):
+        try:
+            return function(*args)
+        except sqlite3.OperationalError as error:
+            message = str(error)
+            if "locked" not in message and "busy" not in message:
+                raise
+            time.sleep(0.05 * 2 ** attempt)
+    return function(*args)
@@ -0,0 +1,191 @@
+import _apientry
+
+
+class Function_Changes(object):
+    """ Differences between the old and new API entries of one function.
+
+        The attributes are lists, or empty tuples for the kinds of changes that were not found. """
+
+    __slots__ = ("name", "positionals_removed", "positionals_moved", "positionals_added",
+                 "keywords_removed", "keywords_modified", "keywords_added",
+                 "returns_removed", "returns_added", "exceptions_removed", "exceptions_added",
+                 "side_effects_removed", "side_effects_added", "deprecated")
+
+    def __init__(self, name):
+        self.name = name
+        self.positionals_removed = self.positionals_moved = self.positionals_added = ()
+        self.keywords_removed = self.keywords_added = () # keys, (key, value)
+        self.keywords_modified = () # (key, old value, new value)
+        self.returns_removed = self.returns_added = ()
+        self.exceptions_removed = self.exceptions_added = ()
+        self.side_effects_removed = self.side_effects_added = ()
+        self.deprecated = False
+
+    def is_major(self):
+        return bool(self.positionals_removed or self.positionals_moved or
+                    self.keywords_removed or self.keywords_modified or
+                    self.returns_removed or self.returns_added or
+                    self.exceptions_removed or self.exceptions_added or
+                    self.side_effects_removed)
+
+    def is_minor(self):
+        return bool(self.positionals_added or self.keywords_added or
+                    self.side_effects_added or self.deprecated)
+
+    def to_dict(self):
+        return dict((name, list(value) if type(value) is tuple else value) for
+                    name, value in ((name, getattr(self, name)) for name in self.__slots__))
+
+
+class Change_Report(object):
+    """ Differences between two APIs.
+
+        change_type is "major", "minor" or "patch".
+        functions_removed and functions_added are lists of API item names.
+        functions is a list of Function_Changes for the items present in both APIs, in the order they were compared. """
+
+    def __init__(self):
+        self.change_type = "patch"
+        self.functions_removed = []
+        self.functions_added = []
+        self.functions = []
+
+    def to_dict(self):
+        """Returns a dictionary of the report that only contains builtin types; unchanged functions are left out."""
+        return {"change_type" : self.change_type,
+                "functions_removed" : list(self.functions_removed),
+                "functions_added" : list(self.functions_added),
+                "functions" : [changes.to_dict() for changes in self.functions if
+                               changes.is_major() or changes.is_minor()]}
+
+
+def compare_apis(api, old_api):
+    """Returns a Change_Report describing how api differs from old_api.
+
+       The APIs are compared as Api_Entry records (see _apientry.build_entries); entries whose
+       values are equal are not compared any further. Every collection is indexed once, so the
+       comparison is linear in the size of the APIs."""
+    # major changes:
+    #   functions in API removed
+    #   positional arguments removed or re-ordered
+    #   keyword arguments removed or renamed
+    #   return types modified
+    #   exceptions modified
+    #       - not sure if adding return types/exceptions constitutes API breaking change
+    #       - cannot assume that code that uses API will work with alternative return types or catch new exceptions, so it seems major
+    # minor changes:
+    #   functions added to API
+    #   positional arguments added
+    #   keyword arguments added
+    # patch changes:
+    #   anything else
+    #       - includes negligible changes like comments
+    api, old_api = _apientry.build_entries(api), _apientry.build_entries(old_api)
+    report = Change_Report()
+    report.functions_removed = [name for name in old_api if name not in api]
+    major = bool(report.functions_removed)
+    minor = False
+    for name, old_values in old_api.iteritems():
+        try:
+            values = api[name]
+        except KeyError: # function was removed from api
+            continue
+        if values == old_values:
+            changes = Function_Changes(name)
+            if "deprecated" in old_values:
+                changes.deprecated = bool(old_values["deprecated"])
+                minor = minor or changes.deprecated
+        else:
+            changes = _compare_function(name, values, old_values)
+            major = major or changes.is_major()
+            minor = minor or changes.is_minor()
+        report.functions.append(changes)
+    report.functions_added = [name for name in api if name not in old_api]
+    if major:
+        report.change_type = "major"
+    elif minor or report.functions_added:
+        report.change_type = "minor"
+    return report
+
+def _compare_function(name, values, old_values):
+    changes = Function_Changes(name)
+    arguments = values.get("arguments", None) or tuple()
+    old_arguments = old_values.get("arguments", None) or tuple()
+    new_set = set(arguments)
+    old_set = set(old_arguments)
+    changes.positionals_added = [argument for argument in arguments if argument not in old_set]
+    changes.positionals_removed, changes.positionals_moved = [], []
+    for index, argument in enumerate(old_arguments):
+        if argument not in new_set:
+            changes.positionals_removed.append(argument)
+        elif index >= len(arguments):
+            break
+        elif arguments[index] != argument:
+            changes.positionals_moved.append(argument)
+
+    keywords = values.get("keywords", None) or dict()
+    old_keywords = old_values.get("keywords", None) or dict()
+    changes.keywords_added = [(key, value) for key, value in keywords.items() if
+                              key not in old_keywords]
+    changes.keywords_removed, changes.keywords_modified = [], []
+    for key, value in old_keywords.items():
+        if key not in keywords:
+            changes.keywords_removed.append(key)
+        elif keywords[key] != value:
+            changes.keywords_modified.append((key, value, keywords[key]))
+
+    changes.returns_removed, changes.returns_added = _compare_sequences(values, old_values, "returns")
+    changes.exceptions_removed, changes.exceptions_added = _compare_sequences(values, old_values, "exceptions")
+    changes.side_effects_removed, changes.side_effects_added = _compare_sequences(values, old_values, "side_effects")
+    changes.deprecated = bool(old_values.get("deprecated", False))
+    return changes
+
+def _compare_sequences(values, old_values, key):
+    new = values.get(key, None) or tuple()
+    old = old_values.get(key, None) or tuple()
+    new_set = set(new)
+    old_set = set(old)
+    return ([item for item in old if item not in new_set],
+            [item for item in new if item not in old_set])
+
+def render_report(report):
+    """Returns a list of the human readable messages that describe report."""
+    messages = []
+    if report.functions_removed:
+        messages.append("Major: Following functions were removed:\n    {}".format('\n'.join(report.functions_removed)))
+    for changes in report.functions:
+        messages.extend(_render_function(changes))
+    if report.functions_added:
+        messages.append("Minor: Following functions were added:\n    {}".format(", ".join(report.functions_added)))
+    return messages
+
+def _render_function(changes):
+    name = changes.name
+    messages = []
+    if changes.positionals_removed:
+        messages.append("Major: Following positional arguments for {} were removed:\n    {}".format(name, ", ".join(changes.positionals_removed)))
+    if changes.positionals_moved:
+        messages.append("Major: Following positional arguments for {} were moved:\n    {}".format(name, "\n".join(changes.positionals_moved)))
+    if changes.positionals_added:
+        messages.append("Minor: Following positional arguments for {} were added:\n    {}".format(name, ", ".join(changes.positionals_added)))
+    if changes.keywords_removed:
+        messages.append("Major: Following keyword arguments for {} were removed:\n    {}".format(name, ", ".join(changes.keywords_removed)))
+    if changes.keywords_modified:
+        formatted = "\n".join("{}: {} -> {}".format(key, value, value2) for key, value, value2 in changes.keywords_modified)
+        messages.append("Major: Following keyword arguments for {} were modified:\n    {}".format(name, formatted))
+    if changes.keywords_added:
+        formatted = "\n".join("    {}: {}".format(key, value) for key, value in changes.keywords_added)
+        messages.append("Minor: Following keyword arguments for {} were added:\n{}".format(name, formatted))
+    if changes.returns_removed:
+        messages.append("Major: Following return types for {} were removed:\n    {}".format(name, ", ".join(changes.returns_removed)))
+    if changes.returns_added:
+        messages.append("Major: Following return types for {} were added:\n    {}".format(name, ", ".join(changes.returns_added)))
+    if changes.exceptions_removed:
+        messages.append("Major: Following exceptions for {} were removed:\n    {}".format(name, ", ".join(changes.exceptions_removed)))
+    if changes.exceptions_added:
+        messages.append("Major: Following exceptions for {} were added:\n    {}".format(name, ", ".join(changes.exceptions_added)))
+    if changes.side_effects_removed:
+        messages.append("Major: Following side effects for {} were removed:\n    {}".format(name, ", ".join(changes.side_effects_removed)))
+    if changes.side_effects_added:
+        messages.append("Minor: Following side effects for {} were added:\n    {}".format(name, ", ".join(changes.side_effects_added)))
+    return messages
@@ -0,0 +1,79 @@
+import hashlib
+import os
+import time
+
+import _timing
+
+RACY_WINDOW_NS = 2 * 1000000000
+CHUNK_SIZE = 1024 * 1024
+HASH_ATTEMPTS = 3
+
+def stat_key(filename):
+    """Returns (size, mtime_ns, inode) for filename."""
+    stat = os.stat(filename)
+    mtime_ns = getattr(stat, "st_mtime_ns", None)
+    if mtime_ns is None:
+        mtime_ns = int(stat.st_mtime * 1000000000)
+    return stat.st_size, mtime_ns, stat.st_ino
+
+def hash_file(filename, chunk_size=CHUNK_SIZE):
+    """Returns the git-compatible blob id of the contents of filename.
+
+       The file is read in binary mode, chunk_size bytes at a time."""
+    with open(filename, "rb") as _file:
+        for attempt in range(HASH_ATTEMPTS):
+            size = os.fstat(_file.fileno()).st_size
+            hash_output = hashlib.sha1("blob {}\0".format(size))
+            _file.seek(0)
+            read = 0
+            chunk = _file.read(chunk_size)
+            while chunk:
+                hash_output.update(chunk)
+                read += len(chunk)
+                chunk = _file.read(chunk_size)
+            if read == size:
+                _timing.count("bytes_hashed", read)
+                return hash_output.hexdigest()
+    raise IOError("'{}' changed size while being hashed".format(filename))
+
+def hash_files(filenames, workers=0):
+    """Returns a list of the digests of filenames, in the same order as filenames.
+
+       Files are hashed on a pool of worker threads; workers defaults to the number of CPUs."""
+    _timing.count("files_hashed", len(filenames))
+    if workers == 1 or len(filenames) < 2:
+        return [hash_file(filename) for filename in filenames]
+    import multiprocessing.pool
+    workers = workers or multiprocessing.cpu_count()
+    pool = multiprocessing.pool.ThreadPool(min(workers, len(filenames)))
+    try:
+        return pool.map(hash_file, filenames, chunksize=1)
+    finally:
+        pool.terminate()
+
+def obtain_file_digests(filenames, cache, rehash=False, workers=0):
+    """Returns a list of the digests of filenames and a list of cache entries that should be stored.
+
+       cache is a dictionary mapping filename -> (size, mtime_ns, inode, digest).
+       Files whose size, mtime and inode match the cache are not read, unless rehash is True.
+       Files modified within RACY_WINDOW_NS of now are hashed but not cached, because
+       a later write within the same timestamp granularity would go unnoticed."""
+    now_ns = int(time.time() * 1000000000)
+    digests = []
+    stale = []
+    for index, filename in enumerate(filenames):
+        key = stat_key(filename)
+        cached = cache.get(filename)
+        if not rehash and cached is not None and tuple(cached[:3]) == key:
+            digests.append(cached[3])
+        else:
+            digests.append(None)
+            stale.append((index, filename, key))
+
+    updates = []
+    new_digests = hash_files([filename for _, filename, _ in stale], workers)
+    for (index, filename, key), digest in zip(stale, new_digests):
+        digests[index] = digest
+        if now_ns - key[1] > RACY_WINDOW_NS:
+            updates.append((filename, ) + key + (digest, ))
+    return digests, updates
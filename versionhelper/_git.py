@@ -0,0 +1,103 @@
+import os
+import subprocess
+
+import _digest
+
+CONVERSION_ATTRIBUTES = ("text", "eol", "crlf", "filter", "ident", "working-tree-encoding")
+
+def _git(directory, *arguments):
+    return subprocess.check_output(("git", ) + arguments, cwd=directory)
+
+def _git_input(directory, data, *arguments):
+    process = subprocess.Popen(("git", ) + arguments, cwd=directory, stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE)
+    output = process.communicate(data)[0]
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, ("git", ) + arguments)
+    return output
+
+def index_entries(directory):
+    """Returns a dictionary mapping path -> blob id for the files beneath directory in the git index,
+       the set of paths that have unresolved merge conflicts and the set of paths that are symbolic
+       links. Paths are relative to directory."""
+    entries = dict()
+    conflicted = set()
+    links = set()
+    for record in _git(directory, "ls-files", "-s", "-z", "--", ".").split("\0"):
+        if not record:
+            continue
+        info, path = record.split("\t", 1)
+        mode, blob_id, stage = info.split(' ')
+        if mode == "160000": # submodule
+            continue
+        if mode == "120000": # the blob is the target of the link, not the contents of the file
+            links.add(path)
+        if stage == "0":
+            entries[path] = blob_id
+        else:
+            conflicted.add(path)
+    return entries, conflicted, links
+
+def converted_paths(directory, paths):
+    """Returns the set of paths (relative to directory) whose contents git may convert between the
+       working tree and the index (line endings, filters, ident or working-tree-encoding), so that
+       the blob id in the index can differ from the blob id of the file."""
+    if not paths:
+        return set()
+    try:
+        autocrlf = _git(directory, "config", "--get", "core.autocrlf").strip().lower()
+    except subprocess.CalledProcessError: # not set
+        autocrlf = "false"
+    output = _git_input(directory, "\0".join(paths) + "\0",
+                        "check-attr", "-z", "--stdin", *CONVERSION_ATTRIBUTES).split("\0")
+    converted = set()
+    binary = set()
+    for index in range(0, len(output) - 2, 3):
+        path, attribute, value = output[index:index + 3]
+        if value == "unset" and attribute in ("text", "crlf"):
+            binary.add(path)
+        elif value not in ("unspecified", "unset"):
+            converted.add(path)
+    if autocrlf not in ("false", "no", "off", "0"): # every file that is not binary may be converted
+        converted.update(path for path in paths if path not in binary)
+    return converted
+
+def dirty_paths(directory):
+    """Returns the set of paths beneath directory whose working tree contents may differ from the index,
+       including untracked files that are not ignored. Paths are relative to directory."""
+    output = _git(directory, "diff-files", "--name-only", "-z", "--relative", "--", ".")
+    output += _git(directory, "ls-files", "-o", "--exclude-standard", "-z", "--", ".")
+    return set(path for path in output.split("\0") if path)
+
+def obtain_file_digests(directory, is_source_file, staged=False, workers=0):
+    """Returns a sorted list of source filenames beneath directory and a list of their blob ids.
+
+       Blob ids of clean files are taken from the git index. If staged is False, files that are
+       modified or untracked in the working tree are hashed from disk, as are symbolic links and
+       files that git converts (see converted_paths), so the blob ids are those of the working tree
+       files; if staged is True, only the index is used. is_source_file is called with each
+       filename to decide whether it is tracked."""
+    directory = os.path.abspath(directory)
+    entries, conflicted, links = index_entries(directory)
+    if staged:
+        dirty = set()
+        for path in conflicted:
+            raise ValueError("'{}' has unresolved merge conflicts".format(path))
+    else:
+        dirty = dirty_paths(directory).union(conflicted, links)
+        dirty.update(converted_paths(directory, [path for path in entries if
+                                                 path not in dirty and is_source_file(path)]))
+    digests = dict()
+    for path, blob_id in entries.items():
+        if path not in dirty and is_source_file(path):
+            digests[os.path.join(directory, *path.split('/'))] = blob_id
+    modified = [os.path.join(directory, *path.split('/')) for path in dirty if is_source_file(path)]
+    modified = [filename for filename in modified if os.path.isfile(filename)]
+    digests.update(zip(modified, _digest.hash_files(modified, workers)))
+    filenames = sorted(digests)
+    return filenames, [digests[filename] for filename in filenames]
+
+def staged_contents(filename):
+    """Returns the contents of filename as recorded in the git index."""
+    directory, name = os.path.split(os.path.abspath(filename))
+    return _git(directory, "show", ":./" + name)
@@ -0,0 +1,14 @@
+import importlib
+import sys
+
+def import_module(module_name):
+    """Imports and returns the pride module called module_name.
+
+       pride parses sys.argv when it is first imported, so it is shown only the program name
+       instead of the arguments that were meant for versionhelper."""
+    argv = sys.argv
+    sys.argv = argv[:1]
+    try:
+        return importlib.import_module(module_name)
+    finally:
+        sys.argv = argv
@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import threading
+import contextlib
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+_LOCK = threading.Lock()
+_HOOKS = []
+_CURRENT = [None]
+
+
+class Run_Timings(object):
+    """ Wall clock time, CPU time and peak memory of each phase of one version_helper run, plus counters. """
+
+    def __init__(self, api_filename):
+        self.api_filename = api_filename
+        self.project = None
+        self.phases = []
+        self.counters = dict()
+        self.started = (time.time(), _cpu_time())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        wall, cpu = time.time(), _cpu_time()
+        try:
+            yield
+        finally:
+            record = {"name" : name, "wall" : time.time() - wall,
+                      "cpu" : _cpu_time() - cpu, "peak_rss_kb" : peak_memory()}
+            self.phases.append(record)
+            for hook in list(_HOOKS):
+                hook(self.api_filename, name, record)
+
+    def count(self, name, amount=1):
+        with _LOCK:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def to_dict(self):
+        return {"api_file" : self.api_filename, "project" : self.project,
+                "phases" : list(self.phases), "counters" : dict(self.counters),
+                "wall" : time.time() - self.started[0],
+                "cpu" : _cpu_time() - self.started[1],
+                "peak_rss_kb" : peak_memory()}
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+def peak_memory():
+    """Returns the peak resident set size of this process in KiB, or None if it cannot be determined."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak # darwin reports bytes
+
+def start(api_filename):
+    """Creates the Run_Timings that phase and count record into until the next call to start or stop."""
+    timings = _CURRENT[0] = Run_Timings(api_filename)
+    return timings
+
+def stop():
+    """Stops recording and calls the hooks with phase None and the record of the whole run."""
+    timings, _CURRENT[0] = _CURRENT[0], None
+    if timings is not None:
+        record = timings.to_dict()
+        for hook in list(_HOOKS):
+            hook(timings.api_filename, None, record)
+        return record
+
+def current():
+    """Returns the Run_Timings that is being recorded, or None."""
+    return _CURRENT[0]
+
+@contextlib.contextmanager
+def phase(name):
+    """Records the enclosed block as phase name of the current run, if there is one."""
+    timings = _CURRENT[0]
+    if timings is None:
+        yield
+    else:
+        with timings.phase(name):
+            yield
+
+def count(name, amount=1):
+    """Adds amount to the counter name of the current run, if there is one. Safe to call from any thread."""
+    timings = _CURRENT[0]
+    if timings is not None:
+        timings.count(name, amount)
+
+def add_hook(hook):
+    _HOOKS.append(hook)
+
+def remove_hook(hook):
+    _HOOKS.remove(hook)
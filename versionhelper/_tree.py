@@ -0,0 +1,85 @@
+"""Merkle tree of the source files of a package.
+
+   A node is the sorted tuple of the (name, kind, digest) entries of one directory, where kind
+   is 'f' for a file (digest is its blob id) or 'd' for a directory (digest is the digest of its
+   node). Only directories that contain source files are part of the tree. Two trees can be
+   compared by descending only into the directories whose digests differ."""
+import hashlib
+
+FILE = 'f'
+DIRECTORY = 'd'
+
+def node_digest(entries):
+    """Returns the digest of the node made of entries."""
+    return hashlib.sha256(''.join("{}\0{}\0{}\0".format(kind, name, digest) for
+                                  name, kind, digest in entries)).hexdigest()
+
+def build_tree(relative_names, file_digests):
+    """Returns the root digest and a dictionary mapping node digest -> entries for the files.
+
+       relative_names are '/' separated paths relative to the root of the tree."""
+    directories = {'' : []}
+    for relative_name, file_digest in zip(relative_names, file_digests):
+        directory, _, name = relative_name.rpartition('/')
+        entries = directories.get(directory)
+        if entries is None:
+            entries = directories[directory] = []
+            parent = directory
+            while parent: # make sure every ancestor directory exists
+                parent = parent.rpartition('/')[0]
+                if parent in directories:
+                    break
+                directories[parent] = []
+        entries.append((name, FILE, file_digest))
+
+    nodes = dict()
+    digests = dict()
+    for directory in sorted(directories, key=lambda path: path.count('/') if path else -1, reverse=True):
+        entries = tuple(sorted(directories[directory]))
+        digest = digests[directory] = node_digest(entries)
+        nodes[digest] = entries
+        if directory:
+            parent, _, name = directory.rpartition('/')
+            directories[parent].append((name, DIRECTORY, digest))
+    return digests[''], nodes
+
+def compare_trees(old_root, new_root, load_node):
+    """Returns a dictionary with the sorted lists of "changed", "added" and "removed" file paths.
+
+       load_node is called with a node digest and returns its entries.
+       Subtrees with equal digests are not visited."""
+    changes = {"changed" : [], "added" : [], "removed" : []}
+    if old_root != new_root:
+        _compare_nodes('', load_node(old_root), load_node(new_root), load_node, changes)
+    for paths in changes.values():
+        paths.sort()
+    return changes
+
+def _compare_nodes(prefix, old_entries, new_entries, load_node, changes):
+    old = dict((name, (kind, digest)) for name, kind, digest in old_entries)
+    new = dict((name, (kind, digest)) for name, kind, digest in new_entries)
+    for name, (kind, digest) in new.iteritems():
+        path = prefix + name
+        if name not in old:
+            _list_files(path, kind, digest, load_node, changes["added"])
+            continue
+        old_kind, old_digest = old[name]
+        if old_digest == digest and old_kind == kind:
+            continue
+        if kind == old_kind == FILE:
+            changes["changed"].append(path)
+        elif kind == old_kind == DIRECTORY:
+            _compare_nodes(path + '/', load_node(old_digest), load_node(digest), load_node, changes)
+        else: # a file was replaced by a directory, or the other way around
+            _list_files(path, old_kind, old_digest, load_node, changes["removed"])
+            _list_files(path, kind, digest, load_node, changes["added"])
+    for name, (kind, digest) in old.iteritems():
+        if name not in new:
+            _list_files(prefix + name, kind, digest, load_node, changes["removed"])
+
+def _list_files(path, kind, digest, load_node, output):
+    if kind == FILE:
+        output.append(path)
+    else:
+        for name, child_kind, child_digest in load_node(digest):
+            _list_files(path + '/' + name, child_kind, child_digest, load_node, output)
@@ -0,0 +1,184 @@
+import fnmatch
+import os
+import re
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+ALWAYS_IGNORED = (".git", ".hg", ".svn", ".bzr")
+IGNORE_FILES = (".gitignore", ".vhignore")
+
+
+class Ignore_Rules(object):
+    """ The ignore patterns (in .gitignore syntax) that apply to one directory.
+
+        rules is a list of (compiled regex, negated, directories only) tuples; the last match wins. """
+
+    def __init__(self, rules=tuple()):
+        self.rules = list(rules)
+
+    def extend(self, directory, relative_directory):
+        """Returns Ignore_Rules that include the ignore files found in directory, or self if there are none."""
+        rules = None
+        for name in IGNORE_FILES:
+            try:
+                with open(os.path.join(directory, name), 'r') as _file:
+                    lines = _file.read().splitlines()
+            except IOError:
+                continue
+            if rules is None:
+                rules = list(self.rules)
+            rules.extend(_compile_rule(line, relative_directory) for line in lines if
+                         line.strip() and not line.startswith('#'))
+        return self if rules is None else Ignore_Rules(rules)
+
+    def ignored(self, relative_path, is_directory):
+        ignored = False
+        for regex, negated, directories_only in self.rules:
+            if (is_directory or not directories_only) and regex.match(relative_path):
+                ignored = not negated
+        return ignored
+
+
+def _compile_rule(line, relative_directory):
+    pattern = line.rstrip()
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    directories_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if '/' in pattern: # anchored to the directory of the ignore file
+        regex = re.escape(relative_directory) + _translate(pattern.lstrip('/'))
+    else:
+        regex = re.escape(relative_directory) + "(?:.*/)?" + _translate(pattern)
+    return re.compile(regex + '$'), negated, directories_only
+
+def _translate(pattern):
+    output = []
+    index = 0
+    while index < len(pattern):
+        character = pattern[index]
+        if pattern.startswith("**/", index):
+            output.append("(?:.*/)?")
+            index += 3
+            continue
+        elif pattern.startswith("**", index):
+            output.append(".*")
+            index += 2
+            continue
+        elif character == '*':
+            output.append("[^/]*")
+        elif character == '?':
+            output.append("[^/]")
+        elif character == '[':
+            end = pattern.find(']', index + 1)
+            if end == -1:
+                output.append(re.escape(character))
+            else:
+                group = pattern[index + 1:end].replace('\\', '\\\\')
+                if group.startswith('!'):
+                    group = '^' + group[1:]
+                output.append('[' + group + ']')
+                index = end
+        else:
+            output.append(re.escape(character))
+        index += 1
+    return ''.join(output)
+
+def glob_filter(include=tuple(), exclude=tuple()):
+    """Returns a function that accepts a relative path (using '/') if it matches one of the include
+       globs (or include is empty) and none of the exclude globs. Globs are matched against the
+       relative path and against the file name."""
+    def matches(relative_path):
+        name = relative_path.rsplit('/', 1)[-1]
+        if include and not any(fnmatch.fnmatch(relative_path, pattern) or
+                               fnmatch.fnmatch(name, pattern) for pattern in include):
+            return False
+        return not any(fnmatch.fnmatch(relative_path, pattern) or
+                       fnmatch.fnmatch(name, pattern) for pattern in exclude)
+    return matches
+
+def ignore_filter(root):
+    """Returns a function that accepts a relative path (using '/') of a file beneath root unless walk
+       would skip it: the file, or one of the directories it is in, is ignored by a .gitignore or
+       .vhignore file or is a version control directory. The ignore files are read when first needed.
+       A relative path that ends with '/' is a directory, and is accepted unless walk would prune it."""
+    root = os.path.abspath(root)
+    directory_rules = dict()
+
+    def rules_for(relative_directory): # None if the directory is ignored
+        try:
+            return directory_rules[relative_directory]
+        except KeyError:
+            pass
+        if not relative_directory:
+            rules = Ignore_Rules().extend(root, '')
+        else:
+            parent, _, name = relative_directory[:-1].rpartition('/')
+            parent_rules = rules_for(parent + '/' if parent else '')
+            if (parent_rules is None or name in ALWAYS_IGNORED or
+                parent_rules.ignored(relative_directory[:-1], True)):
+                rules = None
+            else:
+                rules = parent_rules.extend(os.path.join(root, *relative_directory.split('/')),
+                                            relative_directory)
+        directory_rules[relative_directory] = rules
+        return rules
+
+    def accepts(relative_path):
+        if relative_path.endswith('/'):
+            return rules_for(relative_path) is not None
+        directory = relative_path.rpartition('/')[0]
+        rules = rules_for(directory + '/' if directory else '')
+        return rules is not None and not rules.ignored(relative_path, False)
+    return accepts
+
+def _list_directory(directory):
+    """Yields (name, is_directory, is_symlink) for the entries of directory."""
+    if scandir is not None:
+        for entry in scandir(directory):
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                is_directory = False
+            yield entry.name, is_directory, entry.is_symlink()
+    else:
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            yield name, os.path.isdir(path), os.path.islink(path)
+
+def walk(root, matches, hidden=True):
+    """Returns a sorted list of the files beneath root whose relative path (using '/') is accepted by matches.
+
+       Directories are pruned before they are entered if they are version control directories or
+       are ignored by a .gitignore or .vhignore file, or if hidden is False and their names start
+       with '.'. Symbolic links to directories are not followed."""
+    root = os.path.abspath(root)
+    found = []
+    pending = [(root, '', Ignore_Rules())]
+    while pending:
+        directory, relative_directory, rules = pending.pop()
+        rules = rules.extend(directory, relative_directory)
+        try:
+            entries = list(_list_directory(directory))
+        except OSError:
+            continue
+        for name, is_directory, is_symlink in entries:
+            relative_path = relative_directory + name
+            if is_directory:
+                if not (is_symlink or name in ALWAYS_IGNORED or (not hidden and name[0] == '.') or
+                        rules.ignored(relative_path, True)):
+                    pending.append((os.path.join(directory, name), relative_path + '/', rules))
+            elif not rules.ignored(relative_path, False) and matches(relative_path):
+                found.append(os.path.join(directory, name))
+    found.sort()
+    return found
+
+def read_file_list(_file):
+    """Returns the filenames in a NUL-separated list (e.g. the output of `git ls-files -z`)."""
+    return [filename for filename in _file.read().split("\0") if filename]
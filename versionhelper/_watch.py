@@ -0,0 +1,301 @@
+import StringIO
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import libvh
+import _apientry
+import _apifile
+import _checker
+import _diff
+import _digest
+import _walker
+from _serialization import serialize, deserialize
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE)
+EVENT_HEADER = struct.Struct("iIII")
+DEBOUNCE = 0.02
+
+
+class Inotify_Watcher(object):
+    """ Reports changed paths beneath a set of directories using Linux inotify.
+
+        Directories that are ignored by a .gitignore or .vhignore file (see _walker.walk) are not watched. """
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init failed")
+        self.directories = dict()
+        self.roots = dict() # directory -> the filter of _walker.ignore_filter for it
+        for directory in directories:
+            self.add_tree(directory)
+
+    def add_tree(self, root):
+        """Watches root and the directories beneath it that are not ignored."""
+        accepts = self.roots[root] = _walker.ignore_filter(root)
+        for directory, _ in _walk(root, root, accepts):
+            self.add_directory(directory)
+
+    def add_directory(self, directory):
+        descriptor = self._add_watch(self.fd, directory, WATCH_MASK)
+        if descriptor < 0:
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed for '{}'".format(directory))
+        self.directories[descriptor] = directory
+
+    def wait(self, timeout=None):
+        """Returns the set of paths that changed, or None if events were lost."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return set()
+        data = os.read(self.fd, 65536)
+        changed = set()
+        rules_changed = False
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip("\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            directory = self.directories.get(descriptor)
+            if directory is None or not name:
+                continue
+            path = os.path.join(directory, name)
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    for root, accepts in self.roots.items():
+                        relative_path = _relative_path(path, root)
+                        if relative_path is not None and accepts(relative_path + '/'):
+                            for directory, files in _walk(path, root, accepts):
+                                self.add_directory(directory)
+                                changed.update(files)
+            else:
+                changed.add(path)
+                rules_changed = rules_changed or name in _walker.IGNORE_FILES
+        if rules_changed: # directories that were ignored may have to be watched now
+            for root in list(self.roots):
+                self.add_tree(root)
+        return changed
+
+
+class Polling_Watcher(object):
+    """ Reports changed paths beneath a set of directories by comparing stat results every interval seconds.
+
+        Files and directories that are ignored by a .gitignore or .vhignore file are not polled. """
+
+    def __init__(self, directories, interval=1.0):
+        self.directories = directories
+        self.interval = interval
+        self.snapshot = self._take_snapshot()
+
+    def _take_snapshot(self):
+        snapshot = dict()
+        for directory in self.directories:
+            for _, files in _walk(directory, directory, _walker.ignore_filter(directory)):
+                for path in files:
+                    try:
+                        snapshot[path] = _digest.stat_key(path)
+                    except OSError:
+                        pass
+        return snapshot
+
+    def wait(self, timeout=None):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        snapshot = self._take_snapshot()
+        changed = set(path for path, key in snapshot.items() if self.snapshot.get(path) != key)
+        changed.update(path for path in self.snapshot if path not in snapshot)
+        self.snapshot = snapshot
+        return changed
+
+
+class Watch_State(object):
+    """ Everything needed to recompute the pending version of a project, kept in memory between changes. """
+
+    def __init__(self, api_filename, directory, source_types, db, checkers, workers=0,
+                 include=tuple(), exclude=tuple()):
+        self.api_filename = os.path.abspath(api_filename)
+        self.directory = os.path.abspath(directory)
+        self.db = db
+        self.checkers = checkers
+        self.include = include
+        self.exclude = exclude
+        self._load_api()
+        self.source_types = source_types or libvh._determine_source_types(self.api_info)
+        self.is_source_file = libvh._source_filter(self.source_types, include, exclude, self.directory)
+        filenames = self._find_source_files()
+        digests, _ = _digest.obtain_file_digests(filenames, db.load_file_digests(), False, workers)
+        self.file_digests = dict(zip(filenames, digests))
+        db_entry = db.load_api_info(self.api_info.PROJECT)
+        if db_entry:
+            self.old_digest, old_api, self.old_format = db_entry
+            self.old_api = _apientry.build_entries(deserialize(old_api)) # compared with every new API
+        else:
+            self.old_digest = self.old_api = self.old_format = None
+        self.errors = dict()
+        self.router = None
+        self._check(self.api_info.API.keys())
+
+    def _load_api(self):
+        self.api_info = _apifile.load(self.api_filename)
+        self.serialized_api = serialize(self.api_info.API)
+        self.change_type = None # of the API compared to the stored one; found when first needed
+        self.items_by_prefix = dict()
+        for name in self.api_info.API:
+            segments = name.split('.')
+            for index in range(1, len(segments)):
+                self.items_by_prefix.setdefault('.'.join(segments[:index]), set()).add(name)
+
+    def _find_source_files(self):
+        return libvh._find_source_files(self.directory, self.source_types, self.include, self.exclude)
+
+    def all_files(self):
+        """Returns the set of paths that update has to look at to recompute everything."""
+        changed = set(self.file_digests).union(self._find_source_files())
+        changed.add(self.api_filename)
+        return changed
+
+    def _module_names(self, filename):
+        relative = os.path.splitext(os.path.relpath(filename, self.directory))[0]
+        segments = relative.split(os.sep)
+        if segments[-1] == "__init__":
+            segments.pop()
+        names = ['.'.join(segments)]
+        if os.path.isfile(os.path.join(self.directory, "__init__.py")):
+            names.append('.'.join([os.path.basename(self.directory)] + segments))
+        return names
+
+    def _check(self, items):
+        api = self.api_info.API
+        for name in items:
+            self.errors.pop(name, None)
+            if name in api:
+                try:
+                    if self.router is None:
+                        self.router = _checker.Checker_Router(self.checkers, self.directory)
+                    _checker.check_api_items({name : api[name]}, self.directory, self.checkers,
+                                             router=self.router)
+                except Exception as error:
+                    self.errors[name] = "{}: {}".format(type(error).__name__, str(error).strip())
+
+    def update(self, changed):
+        """Rehashes the changed paths, re-checks the affected API items and returns a status message.
+
+           Returns None if none of the changed paths is the api file, a source file or an ignore file."""
+        affected = set()
+        relevant = self.api_filename in changed
+        if relevant:
+            old_api = self.api_info.API
+            self._load_api()
+            api = self.api_info.API
+            affected.update(name for name in set(api).union(old_api) if
+                            api.get(name) != old_api.get(name))
+        prefix = os.path.join(self.directory, '')
+        changed = [path for path in changed if path.startswith(prefix)]
+        if any(os.path.basename(path) in _walker.IGNORE_FILES for path in changed):
+            # the ignore rules changed, so any source file may have been added or removed
+            relevant = True
+            self.is_source_file = libvh._source_filter(self.source_types, self.include, self.exclude,
+                                                       self.directory)
+            changed = set(changed).union(self.file_digests, self._find_source_files())
+        sources = []
+        for path in changed:
+            if self.is_source_file(path[len(prefix):].replace(os.sep, '/')):
+                try:
+                    self.file_digests[path] = _digest.hash_file(path)
+                except (IOError, OSError):
+                    self.file_digests.pop(path, None)
+            elif self.file_digests.pop(path, None) is None: # not a source file, and it was not one before
+                continue
+            sources.append(path)
+            for module_name in self._module_names(path):
+                affected.update(self.items_by_prefix.get(module_name, ()))
+        if sources:
+            self.router = None # files may have been added or removed
+            for checker in self.checkers:
+                if hasattr(checker, "forget"):
+                    checker.forget(sources)
+        elif not relevant:
+            return None
+        self._check(affected)
+        return self.status()
+
+    def status(self):
+        """Returns a message describing the version bump that would be applied now."""
+        if self.errors:
+            return "Invariant check failed:\n" + "\n".join(self.errors[name] for name in sorted(self.errors))
+        filenames = sorted(self.file_digests)
+        digest, _ = libvh._combine_digests(self.directory, filenames,
+                                           [self.file_digests[filename] for filename in filenames],
+                                           self.serialized_api)
+        version = self.api_info.VERSION
+        if self.old_api is None:
+            return "First run, version is set to {}".format(version)
+        elif digest == self.old_digest:
+            return "No changes. Version number: {}".format(version)
+        if self.change_type is None:
+            api = _apientry.build_entries(self.api_info.API)
+            if self.old_format != libvh.DIGEST_FORMAT and api == self.old_api:
+                self.change_type = '' # the stored digest is replaced without a new version, see Session.plan
+            else:
+                self.change_type = _diff.compare_apis(api, self.old_api).change_type
+        if not self.change_type:
+            return "No changes. Version number: {}".format(version)
+        new_version = libvh._increment_version(self.change_type, version, StringIO.StringIO())
+        return "Pending {} change: {} -> {}".format(self.change_type, version, new_version)
+
+
+def _relative_path(path, root):
+    """Returns path relative to root (using '/'), or None if path is not beneath root."""
+    relative_path = os.path.relpath(path, root).replace(os.sep, '/')
+    return None if relative_path == ".." or relative_path.startswith("../") else relative_path
+
+def _walk(directory, root, accepts):
+    """Yields each directory beneath directory (inclusive) that accepts (a filter of _walker.ignore_filter
+       for root) does not reject, with the list of the paths of the files in it that it accepts."""
+    for path, directories, files in os.walk(directory):
+        relative_directory = _relative_path(path, root)
+        prefix = '' if relative_directory == '.' else relative_directory + '/'
+        directories[:] = [name for name in directories if accepts(prefix + name + '/')]
+        yield path, [os.path.join(path, name) for name in files if accepts(prefix + name)]
+
+def create_watcher(directories, interval=1.0):
+    """Returns an Inotify_Watcher if inotify is available, otherwise a Polling_Watcher."""
+    directories = sorted(set(os.path.abspath(directory) for directory in directories))
+    try:
+        watcher = Inotify_Watcher(directories)
+    except (OSError, AttributeError):
+        return Polling_Watcher(directories, interval)
+    return watcher
+
+def watch(state, watcher, report):
+    """Calls report with the status of state initially and after every batch of changes that
+       affects it; never returns."""
+    report(state.status())
+    while True:
+        changed = watcher.wait()
+        if not changed and changed is not None:
+            continue
+        more = watcher.wait(DEBOUNCE)
+        if changed is None or more is None: # events were lost; fall back to a full rescan
+            changed = state.all_files()
+        else:
+            changed.update(more)
+        started = time.time()
+        message = state.update(changed)
+        if message is not None:
+            report("{} ({:.0f} ms)".format(message, (time.time() - started) * 1000))
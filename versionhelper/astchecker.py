@@ -0,0 +1,142 @@
+"""Invariant checker for python source that reads signatures from the syntax tree.
+
+   Unlike pychecker, the source files are parsed with `ast` and never imported or executed.
+   Select it with `--checker astchecker`."""
+import ast
+import inspect
+import os
+
+import libvh
+import pychecker
+import _digest
+
+LANGUAGES = ("python", )
+SOURCE_EXTENSIONS = (".py", )
+_PARSED = dict()
+_MODULE_FILES = dict() # (source_dir, module name) -> filename; modules that were not found are not kept
+
+
+def check_api_item(function_name, values, source_dir):
+    arg_spec = find_arg_spec(function_name, source_dir)
+    pychecker.check_arg_spec(function_name, values, arg_spec)
+
+def describe_api_item(function_name, source_dir):
+    """Returns the file that defines function_name and its signature string (default values are not shown)."""
+    filename, arg_spec = _find_definition(function_name, source_dir)
+    return [os.path.abspath(filename)], inspect.formatargspec(*arg_spec, formatvalue=lambda value: "=...")
+
+def find_arg_spec(function_name, source_dir):
+    """Returns an inspect.ArgSpec for function_name, which is defined in a module in source_dir."""
+    return _find_definition(function_name, source_dir)[1]
+
+def forget(filenames):
+    """Discards what is known about filenames, so that they are located and parsed again when they are next needed."""
+    filenames = set(os.path.abspath(filename) for filename in filenames)
+    for key, filename in _MODULE_FILES.items():
+        if os.path.abspath(filename) in filenames:
+            del _MODULE_FILES[key]
+    for filename in list(_PARSED):
+        if os.path.abspath(filename) in filenames:
+            del _PARSED[filename]
+
+def _find_definition(function_name, source_dir):
+    segments = function_name.split('.')
+    for index in range(len(segments) - 1, 0, -1):
+        filename = _find_module_file(source_dir, '.'.join(segments[:index]))
+        if filename is not None:
+            definitions = _parse_file(filename)
+            try:
+                arg_spec = definitions['.'.join(segments[index:])]
+            except KeyError:
+                raise libvh.Missing_Api_Functionality("{} does not exist".format(function_name))
+            if arg_spec is None:
+                message = "Unable to statically determine the signature of {}".format(function_name)
+                raise libvh.Missing_Api_Functionality(message)
+            return filename, arg_spec
+    raise libvh.Missing_Api_Functionality("Unable to locate {}".format(function_name))
+
+def _find_module_file(source_dir, module_name):
+    try:
+        return _MODULE_FILES[(source_dir, module_name)]
+    except KeyError:
+        pass
+    segments = module_name.split('.')
+    candidates = [segments]
+    if segments[0] == os.path.basename(os.path.abspath(source_dir)):
+        candidates.append(segments[1:]) # source_dir is the package itself
+    filename = None
+    for candidate in candidates:
+        path = os.path.join(source_dir, *candidate) if candidate else source_dir
+        for option in (path + ".py", os.path.join(path, "__init__.py")):
+            if candidate and os.path.isfile(option):
+                filename = option
+                break
+        if filename is not None:
+            _MODULE_FILES[(source_dir, module_name)] = filename
+            break
+    return filename
+
+def _parse_file(filename):
+    """Returns a dictionary mapping qualified names -> inspect.ArgSpec for filename.
+
+       Results are reused until the size, mtime or inode of the file changes."""
+    key = _digest.stat_key(filename)
+    try:
+        cached_key, definitions = _PARSED[filename]
+    except KeyError:
+        pass
+    else:
+        if cached_key == key:
+            return definitions
+    with open(filename, 'r') as _file:
+        tree = ast.parse(_file.read(), filename)
+    definitions = dict()
+    _collect_definitions(tree.body, '', definitions)
+    _PARSED[filename] = (key, definitions)
+    return definitions
+
+def _collect_definitions(body, prefix, definitions):
+    classes = []
+    for node in body:
+        if isinstance(node, ast.FunctionDef):
+            definitions[prefix + node.name] = _arg_spec_from_node(node.args)
+        elif isinstance(node, ast.ClassDef):
+            definitions[prefix + node.name] = None
+            _collect_definitions(node.body, prefix + node.name + '.', definitions)
+            classes.append(node)
+    class_nodes = dict((node.name, node) for node in classes)
+    for node in classes: # a class is called with the signature of its __init__
+        definitions[prefix + node.name] = _class_arg_spec(node, prefix, definitions, class_nodes)
+
+def _class_arg_spec(node, prefix, definitions, class_nodes, seen=frozenset()):
+    """Returns the signature of the __init__ of the class node, which may be inherited from a
+       base class defined in the same scope (class_nodes maps name -> node), or None."""
+    try:
+        return definitions[prefix + node.name + ".__init__"]
+    except KeyError:
+        pass
+    bases = [base for base in node.bases if not
+             (isinstance(base, ast.Name) and base.id == "object")]
+    if not bases:
+        return inspect.ArgSpec(["self"], None, None, None)
+    elif (len(bases) == 1 and isinstance(bases[0], ast.Name) and bases[0].id in class_nodes and
+          bases[0].id not in seen):
+        return _class_arg_spec(class_nodes[bases[0].id], prefix, definitions, class_nodes,
+                               seen.union((node.name, )))
+    return None # inherited from something that cannot be resolved without importing
+
+def _arg_spec_from_node(arguments):
+    names = [_argument_name(argument) for argument in arguments.args]
+    vararg = _argument_name(arguments.vararg) if arguments.vararg else None
+    kwarg = _argument_name(arguments.kwarg) if arguments.kwarg else None
+    defaults = tuple(arguments.defaults) or None
+    return inspect.ArgSpec(names, vararg, kwarg, defaults)
+
+def _argument_name(argument):
+    if isinstance(argument, str):
+        return argument
+    elif isinstance(argument, ast.Name):
+        return argument.id
+    elif isinstance(argument, ast.Tuple): # def f((a, b)): ...
+        return '(' + ', '.join(_argument_name(item) for item in argument.elts) + ')'
+    return argument.arg
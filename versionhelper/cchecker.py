@@ -0,0 +1,267 @@
+"""Invariant checker for C source that reads function prototypes from headers and source files.
+
+   The .h and .c files beneath the source directory are scanned once to build an index that maps
+   each function name to its prototypes, so checking an API item is a dictionary lookup. The
+   prototypes found in each file are cached on disk (see INDEX_DIRECTORY) with the size, mtime and
+   inode of the file, and only files that changed are scanned again on the next run. The cache
+   is only written by save_caches, which libvh.Session.save_caches calls (not on dry runs).
+
+   API keys may be qualified (e.g. "mylib.add_ints" or "mylib/lib:add_ints"); the last segment is
+   the name of the C function. Only the number of positional arguments is compared, and "..." counts
+   as one argument. Functions declared static, and functions returning function pointers, are not indexed."""
+import hashlib
+import os
+import re
+import time
+
+import libvh
+import _apifile
+import _digest
+import _timing
+import _walker
+from _serialization import serialize, deserialize, is_current_format, Unsupported_Format
+
+LANGUAGES = ("c", )
+SOURCE_EXTENSIONS = (".h", ".c")
+INDEX_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+                               "versionhelper") # created readable by the user only
+KEYWORDS = frozenset(("auto", "break", "case", "char", "const", "continue", "default", "do",
+                      "double", "else", "enum", "extern", "float", "for", "goto", "if", "inline",
+                      "int", "long", "register", "restrict", "return", "short", "signed", "sizeof",
+                      "static", "struct", "switch", "typedef", "union", "unsigned", "void",
+                      "volatile", "while", "_Bool", "_Complex", "_Noreturn", "_Alignas", "_Alignof",
+                      "_Atomic", "_Static_assert", "_Thread_local", "__attribute__", "__declspec",
+                      "__asm__", "__asm", "asm", "__inline", "__inline__", "__restrict"))
+
+_IGNORED = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|^[ \t]*#(?:[^\n]*\\\n)*[^\n]*',
+                      re.S | re.M)
+_DELIMITERS = re.compile(r"[{};]")
+_EXTERN_BLOCK = re.compile(r'\s*extern\s*""\s*$') # extern "C" { ... } does not hide its contents
+_NAME = re.compile(r"[A-Za-z_]\w*")
+_NAME_BEFORE = re.compile(r"([A-Za-z_]\w*)\s*$")
+_POINTER_NAME = re.compile(r"\(\s*\*\s*([A-Za-z_]\w*)")
+_INDEXES = dict()
+_PENDING = dict() # cache filename -> the files that save_caches writes to it
+
+
+def check_api_item(function_name, values, source_dir):
+    filename, line, names, varargs = find_prototype(function_name, source_dir)
+    keywords = values.get("keywords", None)
+    if keywords:
+        message = "\nKeyword argument(s) declared in API for '{}', but C functions do not accept keyword arguments"
+        message += "\nKeyword(s): " + ', '.join(keywords.keys())
+        raise libvh.Mismatched_Api_Argument(message.format(function_name))
+
+    api_arguments = values.get("arguments", None) or tuple()
+    count = len(names) + (1 if varargs else 0)
+    if count != len(api_arguments):
+        message = "\nMismatched positional arguments for '{}'.\n{} argument(s) declared in API, {} argument(s) found in prototype ({}:{})"
+        message = message.format(function_name, len(api_arguments), count, filename, line)
+        raise libvh.Mismatched_Api_Argument(message)
+
+def describe_api_item(function_name, source_dir):
+    """Returns the files that declare function_name and the signature of its first prototype."""
+    prototypes = get_index(source_dir)[_symbol_name(function_name)]
+    filename, line, names, varargs = prototypes[0]
+    arguments = list(names) + (["..."] if varargs else [])
+    filenames = sorted(set(os.path.abspath(prototype[0]) for prototype in prototypes))
+    return filenames, "({})".format(", ".join(arguments))
+
+def find_prototype(function_name, source_dir):
+    """Returns (filename, line, argument names, varargs) for the prototype of function_name in source_dir.
+
+       Prototypes in headers take precedence over those in .c files."""
+    try:
+        return get_index(source_dir)[_symbol_name(function_name)][0]
+    except KeyError:
+        raise libvh.Missing_Api_Functionality("Unable to locate a prototype for {}".format(function_name))
+
+def get_index(source_dir):
+    """Returns the symbol index for source_dir, building it the first time it is needed."""
+    try:
+        return _INDEXES[source_dir]
+    except KeyError:
+        index = _INDEXES[source_dir] = build_index(source_dir)
+        return index
+
+def forget(filenames):
+    """Discards the symbol indices if any of filenames is a C source file, so they are rebuilt on the next check."""
+    if any(os.path.splitext(filename)[1] in SOURCE_EXTENSIONS for filename in filenames):
+        _INDEXES.clear()
+
+def build_index(source_dir, cache_filename=''):
+    """Returns a dictionary mapping function name -> list of (filename, line, argument names, varargs).
+
+       Files whose size, mtime and inode match the entries in cache_filename are not scanned again;
+       cache_filename defaults to a file in INDEX_DIRECTORY that is named after source_dir.
+       The cache file is not written; the changes are kept for the next call to save_caches."""
+    cache_filename = cache_filename or _cache_filename(source_dir)
+    filenames = _walker.walk(source_dir, lambda name: os.path.splitext(name)[1] in SOURCE_EXTENSIONS)
+    cached = _PENDING.get(cache_filename)
+    if cached is None:
+        cached = _load_cache(cache_filename)
+    now_ns = int(time.time() * 1000000000)
+    files = dict()
+    scanned = 0
+    for filename in filenames:
+        key = _digest.stat_key(filename)
+        entry = cached.get(filename)
+        if entry is not None and tuple(entry[:3]) == key:
+            files[filename] = entry
+            continue
+        with open(filename, 'r') as _file:
+            prototypes = scan_source(_file.read())
+        scanned += 1
+        if now_ns - key[1] > _digest.RACY_WINDOW_NS:
+            files[filename] = key + (prototypes, )
+        else: # used for this run only, see _digest.obtain_file_digests
+            files[filename] = (None, None, None, prototypes)
+    _timing.count("c_files_scanned", scanned)
+    if scanned or len(files) != len(cached):
+        _PENDING[cache_filename] = dict((filename, entry) for filename, entry in files.items() if
+                                        entry[0] is not None)
+
+    index = dict()
+    for filename in sorted(files, key=lambda name: (not name.endswith(".h"), name)):
+        for name, line, arguments, varargs in files[filename][3]:
+            index.setdefault(name, []).append((filename, line, arguments, varargs))
+    return index
+
+def save_caches():
+    """Writes the prototypes scanned by build_index since the last call to their cache files."""
+    pending = _PENDING.items()
+    _PENDING.clear()
+    for cache_filename, files in pending:
+        _save_cache(cache_filename, files)
+
+def scan_source(source):
+    """Returns a list of (name, line, argument names, varargs) for the functions declared or defined at file scope in source."""
+    text = _IGNORED.sub(_blank, source)
+    prototypes = []
+    line = 1
+    counted = 0
+    for offset, declaration in _declarations(text):
+        prototype = _parse_declaration(declaration)
+        if prototype is not None:
+            line += text.count('\n', counted, offset + prototype[0])
+            counted = offset + prototype[0]
+            prototypes.append((prototype[1], line) + prototype[2:])
+    return prototypes
+
+def _blank(match):
+    """Replaces comments and preprocessor lines with their newlines, and the contents of literals with nothing."""
+    text = match.group()
+    if text[0] in "\"'":
+        return text[0] * 2
+    return '\n' * text.count('\n') or ' '
+
+def _declarations(text):
+    """Yields (offset, text) for each declaration at file scope; the bodies of functions and structures are skipped."""
+    blocks = [] # True for a block whose contents are skipped
+    skipped = 0
+    start = 0
+    for match in _DELIMITERS.finditer(text):
+        delimiter = match.group()
+        position = match.start()
+        if delimiter == '{':
+            if not skipped:
+                declaration = text[start:position]
+                if _EXTERN_BLOCK.match(declaration):
+                    blocks.append(False)
+                    start = position + 1
+                    continue
+                yield start, declaration
+            blocks.append(True)
+            skipped += 1
+        elif delimiter == '}':
+            if blocks and blocks.pop():
+                skipped -= 1
+            if not skipped:
+                start = position + 1
+        elif not skipped:
+            yield start, text[start:position]
+            start = position + 1
+
+def _parse_declaration(declaration):
+    """Returns (offset of the name, name, argument names, varargs) if declaration is a function, or None."""
+    depth = 0
+    for index, character in enumerate(declaration):
+        if character == '(':
+            if depth == 0:
+                group_start = index
+            depth += 1
+        elif character == ')':
+            depth -= 1
+            if depth == 0:
+                prefix = declaration[:group_start]
+                match = _NAME_BEFORE.search(prefix)
+                if match is None or match.group(1) in KEYWORDS:
+                    continue
+                specifiers = _NAME.findall(prefix[:match.start()])
+                if not specifiers or "typedef" in specifiers or "static" in specifiers or '=' in prefix:
+                    return None
+                names, varargs = _parse_parameters(declaration[group_start + 1:index])
+                return match.start(1), match.group(1), names, varargs
+        elif character == '=' and depth == 0:
+            return None
+    return None
+
+def _parse_parameters(parameters):
+    parameters = _split_parameters(parameters)
+    if parameters == [''] or parameters == ["void"]:
+        return tuple(), False
+    varargs = parameters[-1] == "..."
+    if varargs:
+        del parameters[-1]
+    names = []
+    for index, parameter in enumerate(parameters):
+        match = _POINTER_NAME.search(parameter) # a function pointer, e.g. void (*callback)(int)
+        if match is None:
+            tokens = [name for name in _NAME.findall(parameter.split('[')[0]) if name not in KEYWORDS]
+            name = tokens[-1] if len(_NAME.findall(parameter.split('[')[0])) > 1 and tokens else None
+        else:
+            name = match.group(1)
+        names.append(name or "arg{}".format(index))
+    return tuple(names), varargs
+
+def _split_parameters(parameters):
+    """Splits parameters at the commas that are not nested in parentheses or brackets."""
+    output = []
+    depth = 0
+    start = 0
+    for index, character in enumerate(parameters):
+        if character in "([":
+            depth += 1
+        elif character in ")]":
+            depth -= 1
+        elif character == ',' and depth == 0:
+            output.append(parameters[start:index].strip())
+            start = index + 1
+    output.append(parameters[start:].strip())
+    return output
+
+def _symbol_name(function_name):
+    return re.split(r"[.:/]", function_name)[-1]
+
+def _cache_filename(source_dir):
+    name = hashlib.sha1(os.path.abspath(source_dir)).hexdigest()[:16]
+    return os.path.join(INDEX_DIRECTORY, "versionhelper_cindex_{}".format(name))
+
+def _load_cache(cache_filename):
+    """Returns the dictionary mapping filename -> (size, mtime_ns, inode, prototypes) stored in cache_filename."""
+    try:
+        with open(cache_filename, "rb") as _file:
+            data = _file.read()
+        return deserialize(data) if is_current_format(data) else dict()
+    except (IOError, ValueError, Unsupported_Format):
+        return dict()
+
+def _save_cache(cache_filename, files):
+    """Replaces cache_filename with files. Failures are ignored, because the cache is only an optimisation."""
+    try:
+        directory = os.path.dirname(cache_filename)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        _apifile.replace_file(cache_filename, serialize(files))
+    except (IOError, OSError):
+        pass
@@ -1,14 +1,22 @@
 import StringIO
+import errno
 import os
-import importlib
+import glob
 import hashlib
 import types
 import string
+import sys
 
-from _database import API_Database
-from _serialization import serialize, deserialize
-import _checker
-import pychecker
+# the checkers, the database (pride) and the multiprocessing, git and watch
+# support are imported by the functions that use them, to keep startup fast
+from _serialization import serialize, deserialize, is_current_format
+import _apifile
+import _apientry
+import _digest
+import _diff
+import _walker
+import _timing
+import _tree
 
 class Missing_Api_Functionality(Exception):
     """ Raised when a checker cannot locate an item listed in the API. """
@@ -22,17 +30,36 @@ class Unspecified_Source_Types(Exception):
 class Missing_Api_Info(Exception):
     """ Raised when the VERSION, PROJECT attributes are not present in the api file. """
 
+class Stale_Plan(ValueError):
+    """ Raised when the database was changed by another process after a plan was made; plans holds the affected Plans. """
 
-SOURCE_TYPE = {"python" : ("py", ), "c" : ("c", )}
+    def __init__(self, message, plans=tuple()):
+        super(Stale_Plan, self).__init__(message)
+        self.plans = list(plans)
+
+
+SOURCE_TYPE = {"python" : ("py", ), "c" : ("c", "h")}
 ASCII_ALPHANUMERICS = set(string.ascii_letters + string.digits)
+BUILTIN_CHECKERS = ("pychecker", "astchecker", "cchecker")
+LANGUAGE_CHECKER = {"python" : "pychecker", "c" : "cchecker"}
+PLAN_RETRIES = 3 # times a run is planned again when its plan is found to be stale
+DIGEST_FORMAT = 1 # stored with each package digest; changed whenever the same sources would get a different digest
+_DATABASES = dict()
 
 def version_helper(api_filename, directory='', version='', prerelease='', build_metadata='',
                    db='', checker='', source_types=tuple(), no_invariant_check=False,
-                   dry_run=False, silent=False):
+                   dry_run=False, silent=False, rehash=False, workers=0,
+                   check_processes=1, check_timeout=0, use_git=False, staged=False,
+                   include=tuple(), exclude=tuple(), source_files=tuple(),
+                   output_format="text", changelog='', force_check=False):
     """Usage: version_helper(api_filename, directory='', version='', prerelease='',
                              build_metadata='', db='', checker='', source_types=tuple(),
                              no_invariant_check=False, dry_run=False,
-                             silent=False) => None
+                             silent=False, rehash=False, workers=0,
+                             check_processes=1, check_timeout=0, use_git=False,
+                             staged=False, include=tuple(), exclude=tuple(),
+                             source_files=tuple(), output_format="text",
+                             changelog='', force_check=False) => None
        Inspect api file indicated by api_filename and relevant source code, and increment semantic version number in api file as necessary.
 
        # Arguments
@@ -43,11 +70,23 @@ def version_helper(api_filename, directory='', version='', prerelease='', build_
        prerelease is a string of a prerelease information to be attached to the version number.
        build_metadata is a string of build metadata to be attached to the version number.
        db is a filename for the database file to be used. If the file does not exist, it will be created.
-       checker is the file path for an invariance checker module.
+       checker is the file path for an invariance checker module, or the name of a built-in checker (see BUILTIN_CHECKERS).
        source_types is an iterable of file extensions indicating what type of source files to track
        no_invariant_check is a boolean flag indicating whether or not to run the invariant checker
        dry_run is a boolean flag indicating whether or not to perform a dry run (don't write to DB or API file)
        silent is a boolean flag indicating whether or not to silence output to stdout
+       rehash is a boolean flag indicating whether or not to ignore cached file digests and re-read every source file
+       workers is an integer indicating how many threads to use when hashing source files
+       check_processes is an integer indicating how many processes to run the invariant checker in
+       check_timeout is a number of seconds that the invariant checker may spend on one API item
+       use_git is a boolean flag indicating whether or not to take the digests of unmodified files from the git index
+       staged is a boolean flag indicating whether or not to use only the staged (indexed) api file and source files
+       include is an iterable of glob strings; only source files that match one of them are tracked
+       exclude is an iterable of glob strings; source files that match one of them are not tracked
+       source_files is an iterable of filename strings to track instead of searching directory
+       output_format is "text" or "json" and selects what is printed to stdout
+       changelog is the filename string of the changelog file, relative to the directory of the api file
+       force_check is a boolean flag indicating whether or not to run the invariant checker on every item even if nothing changed
 
        # All arguments except for api_filename are optional.
        ------------
@@ -61,78 +100,674 @@ def version_helper(api_filename, directory='', version='', prerelease='', build_
        If no_invariant_check is not specified, then the invariant checker will be run if available
        If dry_run is not specified, then the run *will* write to the DB and API
        If silent is not specified, then information will be printed to stdout
+       If rehash is not specified, then source files whose size, mtime and inode are unchanged will not be re-read
+       If workers is not specified, then one thread per CPU will be used to hash source files
+       If check_processes is not specified, then the invariant checker runs in the current process and stops at the first mismatch
+       If check_timeout is not specified, then there is no time limit (check_timeout only applies when check_processes is greater than 1)
+       If use_git is not specified, then the files in directory are hashed (using the File_Digest cache)
+       If staged is not specified, then the working tree is used. staged implies use_git; the api file in the working tree is still the one that is updated
+       If include and exclude are not specified, then every file of the source types is tracked, except in directories or files ignored by a .gitignore or .vhignore file
+       If source_files is not specified, then directory is searched for source files
+       If output_format is not specified, then the changelog messages are printed. If it is "json", then a single JSON object is printed instead; it has the keys of the summaries returned by batch_version_helper
+       If changelog is not specified, then "apichangelog.txt" in the directory of the api file will be used
+       If force_check is not specified, then the invariant checker is skipped when the digest matches the database and the last check with the same checkers passed, and items whose results are cached are not checked again
 
        # Side Effects
        -----------
        The VERSION attribute of the indicated api file may be modified.
-       The database may be modified (insert and/or update_table)."""
-    if version and len(version.split('.', 2)) != 3:
-        raise ValueError("Invalid version string '{}'".format(version))
-    if dry_run and not silent:
+       The database may be modified. The stored version is read and updated in one transaction; if another
+       process changed it since it was read, the run is planned again (up to PLAN_RETRIES times).
+       The changelog file is overwritten (unless dry_run is set).
+       The File_Digest table of the database may be modified (unless dry_run is set), even if the version does not change.
+       Every version change (and the first run) is recorded in the Api_History table, with a snapshot of the API in Api_Snapshot.
+       The source tree of the recorded version is stored in the Tree_Node and Api_Tree tables; when the digest changes, the changed, added and removed source files are reported."""
+    _version_helper(api_filename, directory, version, prerelease, build_metadata,
+                    db, checker, source_types, no_invariant_check, dry_run,
+                    silent, rehash, workers, check_processes, check_timeout,
+                    use_git, staged, include, exclude, source_files, output_format,
+                    changelog, force_check)
+
+def batch_version_helper(api_filenames=tuple(), root='', processes=0, prerelease='',
+                         build_metadata='', db='', checker='', source_types=tuple(),
+                         no_invariant_check=False, dry_run=False, silent=False,
+                         rehash=False, workers=0, check_processes=1, check_timeout=0,
+                         use_git=False, staged=False, include=tuple(), exclude=tuple(),
+                         output_format="text", changelog='', force_check=False):
+    """Usage: batch_version_helper(api_filenames=tuple(), root='', processes=0,
+                                   prerelease='', build_metadata='', db='', checker='',
+                                   source_types=tuple(), no_invariant_check=False,
+                                   dry_run=False, silent=False, rehash=False,
+                                   workers=0, check_processes=1, check_timeout=0,
+                                   use_git=False, staged=False, include=tuple(),
+                                   exclude=tuple(), output_format="text",
+                                   changelog='', force_check=False) => list of dict
+       Run version_helper on many api files in one process (or one pool of processes).
+
+       # Arguments
+       ------------
+       api_filenames is an iterable of api filename strings; glob patterns are expanded.
+       root is a directory path string; every "api.py" file found beneath it is processed.
+       processes is an integer indicating how many worker processes to use.
+       output_format is "text" (one line per api file) or "json" (a JSON list of the summaries).
+       The remaining arguments are passed to version_helper for every api file.
+
+       If processes is not specified, then one process per CPU will be used.
+       If processes is 1, then every project is processed in the current process and shares one database connection per database file.
+       The plans of all projects are then applied together, with one transaction per database file
+       (the "write" phase is not part of the timings of the projects in that case).
+
+       # Returns
+       ------------
+       A list with one summary dictionary per api file, in the order the files were given (or found).
+       Each summary has the keys "api_file", "project", "old_version", "new_version", "change",
+       "report", "files", "changelog", "timings" and "error".
+       "change" is one of "major", "minor", "patch", "set", "metadata", "first run" or None (no changes).
+       "report" is None, or a dictionary with the keys "change_type", "functions_removed", "functions_added"
+       and "functions" (the changes to each function that was modified) when the APIs were compared.
+       "files" is None, or a dictionary with the sorted lists of "changed", "added" and "removed" source
+       files (relative to the source directory) when the digest differs from the one stored in the database.
+       "changelog" is the text written to the changelog file.
+       "timings" is the record described in add_phase_hook.
+       "error" is None, or the message of the exception that stopped the project from being processed.
+
+       # Side Effects
+       -----------
+       Same as version_helper, for every api file."""
+    import multiprocessing
+    api_filenames = _find_api_files(api_filenames, root)
+    options = {"prerelease" : prerelease, "build_metadata" : build_metadata,
+               "db" : db, "checker" : checker, "source_types" : source_types,
+               "no_invariant_check" : no_invariant_check, "dry_run" : dry_run,
+               "rehash" : rehash, "workers" : workers,
+               "check_processes" : check_processes, "check_timeout" : check_timeout,
+               "use_git" : use_git, "staged" : staged,
+               "include" : include, "exclude" : exclude, "changelog" : changelog,
+               "force_check" : force_check}
+    jobs = [(api_filename, options) for api_filename in api_filenames]
+    processes = min(processes or multiprocessing.cpu_count(), len(jobs))
+    if dry_run and not (silent or output_format == "json"):
         print("Performing a dry run; Changes will not be written to DB or API file")
+    if processes <= 1:
+        summaries = _batch_session(api_filenames, options)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            summaries = pool.map(_batch_worker, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    if not silent:
+        if output_format == "json":
+            import json
+            print(json.dumps(summaries, indent=4, sort_keys=True))
+        else:
+            for summary in summaries:
+                print(_format_summary(summary))
+    return summaries
+
+def watch(api_filename, directory='', db='', checker='', source_types=tuple(),
+          no_invariant_check=False, workers=0, interval=1.0, include=tuple(), exclude=tuple()):
+    """Usage: watch(api_filename, directory='', db='', checker='', source_types=tuple(),
+                    no_invariant_check=False, workers=0, interval=1.0,
+                    include=tuple(), exclude=tuple()) => None
+       Load the api file, database and source file digests once, then print the pending version change every time the api file or a source file changes.
 
-    api_info = _load_module_from_filename(api_filename, "api")
+       Only the changed files are rehashed and only the API items defined in them are re-checked.
+       inotify is used where it is available; otherwise the files are polled every interval seconds.
+       Directories ignored by a .gitignore or .vhignore file are not watched, and changes to files
+       that are not tracked (see include and exclude) are not reported.
+       The arguments have the same meaning as for version_helper.
+       This function does not return.
+
+       # Side Effects
+       -----------
+       None; the api file and database are never written to."""
+    import _watch
+    api_filename = os.path.abspath(api_filename)
+    directory = os.path.abspath(directory or os.path.split(api_filename)[0])
+    db = _open_database(db or os.path.join(os.path.split(api_filename)[0], "api.db"))
+    api_info = _apifile.load(api_filename)
+    checkers = [] if no_invariant_check else _select_checkers(api_info, checker, False)
+    state = _watch.Watch_State(api_filename, directory, source_types, db, checkers, workers,
+                               include, exclude)
+    watcher = _watch.create_watcher([directory, os.path.split(api_filename)[0]], interval)
+    if not isinstance(watcher, _watch.Inotify_Watcher):
+        print("inotify is not available; polling every {} second(s)".format(interval))
+    _watch.watch(state, watcher, _print)
+
+def add_phase_hook(hook):
+    """Usage: add_phase_hook(hook) => None
+       Call hook(api_filename, phase, record) whenever version_helper finishes a phase of its work.
+
+       phase is one of "load", "check", "serialize", "digest", "db", "diff" or "write".
+       record is a dictionary with the keys "name", "wall" and "cpu" (seconds) and "peak_rss_kb"
+       (the peak resident set size of the process so far, or None where it is not available).
+       When a run finishes, hook is called once more with phase None and a record of the whole run:
+       a dictionary with the keys "api_file", "project", "phases" (the list of phase records),
+       "counters" (e.g. "files_walked", "bytes_hashed", "items_checked", "items_cached", "modules_imported"),
+       "wall", "cpu" and "peak_rss_kb".
+       Hooks are called in the process that does the work."""
+    _timing.add_hook(hook)
+
+def remove_phase_hook(hook):
+    """Usage: remove_phase_hook(hook) => None
+       Stop calling a hook that was added with add_phase_hook; Raises ValueError if it was not added."""
+    _timing.remove_hook(hook)
+
+def _print(message):
+    print(message)
+
+def _find_api_files(api_filenames, root):
+    """Returns the api files named by api_filenames and found beneath root; a file that is named
+       more than once (e.g. through a symbolic link) is only returned the first time."""
+    found = []
+    for pattern in api_filenames:
+        if glob.has_magic(pattern):
+            found.extend(sorted(glob.glob(pattern)))
+        else:
+            found.append(pattern)
+    if root: # ignored and hidden directories are not entered
+        prefix = os.path.join(os.path.abspath(root), '')
+        found.extend(os.path.join(root, filename[len(prefix):]) for filename in
+                     _walker.walk(root, lambda relative_path: relative_path.rsplit('/', 1)[-1] == "api.py",
+                                  hidden=False))
+    seen = set()
+    unique = []
+    for filename in found:
+        path = os.path.realpath(filename)
+        if path not in seen:
+            seen.add(path)
+            unique.append(filename)
+    return unique
+
+def _batch_session(api_filenames, options):
+    """Plans every api file with one Session, then applies the plans with one commit per database.
+
+       Nothing is printed, as in the worker processes; batch_version_helper prints the summaries."""
+    options = options.copy()
+    prerelease, build_metadata = options.pop("prerelease"), options.pop("build_metadata")
+    dry_run, changelog = options.pop("dry_run"), options.pop("changelog")
+    session = Session(**options)
+    summaries, plans = [], dict()
+
+    def fail(index, error): # keeps the timings of the plan
+        timings = summaries[index]["timings"]
+        summaries[index] = _error_summary(api_filenames[index], error)
+        summaries[index]["timings"] = timings
+        del plans[index]
+
+    def plan(index):
+        api_filename = api_filenames[index]
+        _timing.start(api_filename)
+        try:
+            plans[index] = session.plan(api_filename, prerelease=prerelease,
+                                        build_metadata=build_metadata)
+        except Exception as error:
+            plans.pop(index, None)
+            summaries[index] = _error_summary(api_filename, error)
+        else:
+            summaries[index] = plans[index].to_dict()
+            summaries[index]["timings"] = _timing.stop()
+            summaries[index]["error"] = None
+
+    for index in range(len(api_filenames)):
+        summaries.append(None)
+        plan(index)
+    if dry_run:
+        return summaries
+    for attempt in range(PLAN_RETRIES + 1):
+        try:
+            session.apply_all([plans[index] for index in sorted(plans) if not plans[index].applied],
+                              changelog)
+        except Stale_Plan as error:
+            for index in sorted(plans):
+                if plans[index] in error.plans:
+                    if attempt == PLAN_RETRIES:
+                        fail(index, error)
+                    else:
+                        plan(index)
+        except Exception as error: # the plans that were not committed
+            for index in sorted(plans):
+                if not plans[index].applied:
+                    fail(index, error)
+            break
+        else:
+            break
+    session.save_caches()
+    return summaries
 
+def _error_summary(api_filename, error):
+    return {"api_file" : api_filename, "project" : None, "old_version" : None,
+            "new_version" : None, "change" : None, "report" : None,
+            "files" : None, "changelog" : None, "timings" : _timing.stop(),
+            "error" : "{}: {}".format(type(error).__name__, error)}
+
+def _batch_worker(job, silent=True):
+    api_filename, options = job
     try:
-        project_name = api_info.PROJECT
-    except AttributeError:
-        raise Missing_Api_Info("Project name not found. PROJECT attribute not set in api file.")
+        return _version_helper(api_filename, silent=silent, **options)
+    except Exception as error:
+        return _error_summary(api_filename, error)
+
+def _format_summary(summary):
+    name = summary["project"] or summary["api_file"]
+    if summary["error"]:
+        return "{}: error: {}".format(name, summary["error"])
+    elif summary["change"] is None:
+        return "{}: no changes ({})".format(name, summary["old_version"])
+    return "{}: {} -> {} ({})".format(name, summary["old_version"],
+                                      summary["new_version"], summary["change"])
+
+def _open_database(filename):
+    """Returns an API_Database for filename, reusing one connection per file within this process."""
+    from _database import API_Database
+    key = os.path.abspath(filename)
     try:
-        api_info.VERSION
-    except AttributeError:
-        raise Missing_Api_Info("Version number not found. VERSION attribute not set in api file.")
+        return _DATABASES[key]
+    except KeyError:
+        db = _DATABASES[key] = API_Database(database_name=filename)
+        return db
 
-    directory = directory if directory else (os.path.split(api_filename)[0] or os.curdir)
-    _run_invariant_checker(api_info, no_invariant_check, silent, checker, directory)
+class Plan(object):
+    """ The outcome of Session.plan for one api file. Nothing has been written when a Plan is returned.
 
-    if not source_types:
-        source_types = _determine_source_types(api_info)
-    serialized_api = serialize(api_info.API)
-    digest = _obtain_package_digest(directory, serialized_api, source_types)
+        api_file, project, old_version, new_version, change, report (a Change_Report or None), files
+        and changelog have the meaning described for the summaries of batch_version_helper. The other
+        attributes hold what Session.apply writes. """
 
-    if not db:
-        db = os.path.join(os.path.split(api_filename)[0] or os.path.curdir, "api.db")
-    db = API_Database(database_name=db or DATABASE)
-    old_digest, old_api, db_entry = _obtain_old_api_info(db, project_name, dry_run, api_info, digest, serialized_api)
+    def __init__(self, api_file, project, old_version):
+        self.api_file = api_file
+        self.project = project
+        self.old_version = old_version
+        self.new_version = old_version
+        self.change = None
+        self.report = None
+        self.files = None
+        self.changelog = ''
+        self.applied = False
+        self.db = None
+        self.api_info = None
+        self.digest = None
+        self.basis = None # the stored digest the plan was made from (None on the first run)
+        self.serialized_api = None
+        self.tree = None
+        self.checker_names = None
+        self.insert = False # first run: add the project to Api_Info
+        self.rebaseline = False # replace a stored digest of an older DIGEST_FORMAT, keeping the version
+        self.migrate_api = None # the stored API, to be rewritten in the current format
+        self.update = False # write the new version to the api file, Api_Info and Api_History
+        self.record = False # record the first version in Api_History
+        self.store_tree = False
+
+    def to_dict(self):
+        """Returns the summary dictionary described in batch_version_helper, without "timings" and "error"."""
+        return {"api_file" : self.api_file, "project" : self.project,
+                "old_version" : self.old_version, "new_version" : self.new_version,
+                "change" : self.change, "report" : self.report.to_dict() if self.report else None,
+                "files" : self.files, "changelog" : self.changelog}
+
+
+class Session(object):
+    """Usage: Session(db='', checker='', source_types=tuple(), no_invariant_check=False,
+                      rehash=False, workers=0, check_processes=1, check_timeout=0,
+                      use_git=False, staged=False, include=tuple(), exclude=tuple(),
+                      force_check=False, silent=True) => Session
+       Runs version_helper on many api files in one process, keeping database connections,
+       checker modules and caches between runs.
+
+       The arguments have the same meaning as for version_helper and apply to every api file.
+       If silent is False, messages about the selection of invariant checkers are printed.
+
+       plan(api_filename, ...) determines the new version of an api file and returns a Plan,
+       without writing anything. apply(plan) writes it to the api file, database and changelog.
+       The file digests and invariant check results found by plan are cached in the database
+       by the next call to apply or save_caches.
+
+       # Side Effects
+       -----------
+       None until apply or save_caches is called."""
+
+    def __init__(self, db='', checker='', source_types=tuple(), no_invariant_check=False,
+                 rehash=False, workers=0, check_processes=1, check_timeout=0,
+                 use_git=False, staged=False, include=tuple(), exclude=tuple(),
+                 force_check=False, silent=True):
+        self.db = db
+        self.checker = checker
+        self.source_types = source_types
+        self.no_invariant_check = no_invariant_check
+        self.rehash = rehash
+        self.workers = workers
+        self.check_processes = check_processes
+        self.check_timeout = check_timeout
+        self.use_git = use_git
+        self.staged = staged
+        self.include = include
+        self.exclude = exclude
+        self.force_check = force_check
+        self.silent = silent
+        self.checkers = dict()
+        self.pending_caches = []
+
+    def plan(self, api_filename, directory='', version='', prerelease='', build_metadata='',
+             source_files=tuple()):
+        """Usage: session.plan(api_filename, directory='', version='', prerelease='',
+                               build_metadata='', source_files=tuple()) => Plan
+           Determines the new version of the api file api_filename, running the invariant checker if necessary.
+
+           The arguments have the same meaning as for version_helper.
+
+           # Side Effects
+           -----------
+           None; nothing is written or printed (unless silent is False)."""
+        if version and len(version.split('.', 2)) != 3:
+            raise ValueError("Invalid version string '{}'".format(version))
+        with _timing.phase("load"):
+            if self.staged:
+                import _git
+                api_info = _apifile.load_source(_git.staged_contents(api_filename), api_filename)
+            else:
+                api_info = _apifile.load(api_filename)
+        try:
+            project_name = api_info.PROJECT
+        except AttributeError:
+            raise Missing_Api_Info("Project name not found. PROJECT attribute not set in api file.")
+        try:
+            api_info.VERSION
+        except AttributeError:
+            raise Missing_Api_Info("Version number not found. VERSION attribute not set in api file.")
+        plan = Plan(api_filename, project_name, api_info.VERSION)
+        plan.api_info = api_info
+        timings = _timing.current()
+        if timings is not None:
+            timings.project = project_name
+
+        directory = directory if directory else (os.path.split(api_filename)[0] or os.curdir)
+        with _timing.phase("db"):
+            db = plan.db = _open_database(self.db or os.path.join(os.path.split(api_filename)[0] or os.curdir, "api.db"))
+        checkers = [] if self.no_invariant_check else self._select_checkers(api_info)
+        checker_names = plan.checker_names = None if self.no_invariant_check else _checker_names(checkers)
+        source_types = self.source_types or _determine_source_types(api_info)
+
+        with _timing.phase("serialize"):
+            serialized_api = plan.serialized_api = serialize(api_info.API)
+        with _timing.phase("digest"):
+            if (self.use_git or self.staged) and not source_files:
+                digest, tree = _obtain_git_digest(directory, serialized_api, source_types, self.staged,
+                                                  self.workers, self.include, self.exclude)
+            else:
+                digest, tree, updates, removed = _hash_package(directory, serialized_api, source_types, db,
+                                                               self.rehash, self.workers, self.include,
+                                                               self.exclude, source_files)
+                if updates or removed:
+                    self.pending_caches.append((db, updates, removed, tuple()))
+        plan.digest, plan.tree = digest, tree
 
-    if dry_run:
         _file = StringIO.StringIO()
-        _update_version(digest, old_digest, version, prerelease, build_metadata,
-                        db, silent, api_info, old_api, dry_run, serialized_api,
-                        db_entry, _file)
-    else:
-        with open("apichangelog.txt", 'w') as _file:
-            _update_version(digest, old_digest, version, prerelease, build_metadata,
-                            db, silent, api_info, old_api, dry_run, serialized_api,
-                            db_entry, _file)
+        with _timing.phase("db"):
+            unchanged = (not (self.force_check or version or prerelease or build_metadata) and
+                         _is_unchanged(db, project_name, digest, checker_names))
+        if unchanged: # the invariant checker passed for this digest on an earlier run
+            _timing.count("fast_path")
+            plan.basis = digest
+            _file.write("No changes. Version number: {}\n".format(api_info.VERSION))
+            plan.checker_names = None
+        else:
+            with _timing.phase("check"):
+                entries = _apientry.build_entries(api_info.API) if checkers else None # shared with the diff
+                self._check(api_info, directory, db, checkers, entries)
+            with _timing.phase("db"):
+                old_digest, old_api, db_entry = _obtain_old_api_info(db, project_name, api_info, digest)
+                old_tree = db.load_tree_root(project_name)
+            plan.basis = old_digest if db_entry else None
+            plan.insert = not db_entry
+            if db_entry and not is_current_format(db_entry[1]):
+                plan.migrate_api = old_api
+            if db_entry and db_entry[2] != DIGEST_FORMAT and not (version or prerelease or build_metadata):
+                if entries is None: # no checkers; also used by _update_version
+                    entries = _apientry.build_entries(api_info.API)
+                if entries == old_api:
+                    # the stored digest was computed differently, so a different digest does not mean that
+                    # the source changed; it is replaced without changing the version. If the API changed,
+                    # the APIs are compared (and the version changed) as usual.
+                    plan.rebaseline = True
+                    old_digest = digest
+                    _file.write("Digest format changed; the stored digest is replaced\n")
+
+            if db_entry and digest != old_digest and old_tree is not None:
+                with _timing.phase("diff"):
+                    plan.files = _compare_source_trees(db, old_tree, tree)
+                _file.write(_render_file_changes(plan.files))
+            plan.new_version, plan.change, plan.report, plan.update = \
+                _update_version(digest, old_digest, version, prerelease, build_metadata,
+                                api_info, old_api, db_entry, _file, entries)
+            plan.record = not db_entry and not plan.update
+            plan.store_tree = plan.change is not None or old_tree is None or plan.rebaseline
+        plan.changelog = _file.getvalue()
+        return plan
+
+    def apply(self, plan, changelog=''):
+        """Usage: session.apply(plan, changelog='') => None
+           Writes plan (returned by plan()) to the api file, the database and the changelog file.
 
+           changelog has the same meaning as for version_helper.
+           Raises Stale_Plan if the stored version of the project was changed since plan was made;
+           nothing is written in that case, and a new plan should be made.
+
+           # Side Effects
+           -----------
+           The side effects of version_helper. The cached file digests and check results of
+           earlier calls to plan are also stored."""
+        self.apply_all([plan], changelog)
+
+    def apply_all(self, plans, changelog=''):
+        """Usage: session.apply_all(plans, changelog='') => None
+           Writes every plan in plans, with one database transaction (and commit) per database.
+
+           changelog has the same meaning as for version_helper.
+           Raises Stale_Plan if the stored version of any project was changed since its plan was
+           made; the plans for the same database are then not written, and the stale ones (in the
+           plans attribute of the exception) should be made again. The plans for other databases
+           that were written before are marked as applied.
+           The api files and changelog files are written after the transaction of their database
+           commits. Their directories are checked before anything is written, and IOError is raised
+           if one of them cannot be written.
+
+           # Side Effects
+           -----------
+           The side effects of version_helper, for every plan. The cached file digests and check
+           results of earlier calls to plan are also stored."""
+        for plan in plans:
+            if plan.applied:
+                raise ValueError("Plan for '{}' has already been applied".format(plan.api_file))
+        self.save_caches()
+        files = dict((id(plan), _plan_files(plan, changelog)) for plan in plans) # before anything is written
+        by_database = []
+        for plan in plans:
+            for db, db_plans in by_database:
+                if db is plan.db:
+                    db_plans.append(plan)
+                    break
+            else:
+                by_database.append((plan.db, [plan]))
+        for db, db_plans in by_database:
+            with _timing.phase("write"):
+                with db.transaction():
+                    stale = [plan for plan in db_plans if _stored_digest(db, plan.project) != plan.basis]
+                    if stale:
+                        raise Stale_Plan("The database was changed after the plan for {} was made".format(
+                                         ", ".join(plan.project for plan in stale)), stale)
+                    for plan in db_plans:
+                        _write_plan(plan)
+                for plan in db_plans: # once the transaction is committed
+                    for filename, data in files[id(plan)]:
+                        _apifile.replace_file(filename, data)
+                    plan.applied = True
+
+    def save_caches(self):
+        """Usage: session.save_caches() => None
+           Stores the file digests and invariant check results found by plan() since the last call in the database.
+
+           # Side Effects
+           -----------
+           The File_Digest and Check_Cache tables of the databases may be modified, and the
+           save_caches function of each checker module that has one (e.g. cchecker) is called."""
+        pending, self.pending_caches = self.pending_caches, []
+        databases = []
+        for db, _, _, _ in pending:
+            if db not in databases:
+                databases.append(db)
+        for db in databases: # one commit per database
+            with db.transaction():
+                for cache_db, updates, removed, check_rows in pending:
+                    if cache_db is not db:
+                        continue
+                    if updates or removed:
+                        db.store_file_digests(updates, removed)
+                    if check_rows:
+                        db.store_check_cache(check_rows)
+        saved = []
+        for checkers in self.checkers.values():
+            for checker in checkers:
+                if hasattr(checker, "save_caches") and checker not in saved:
+                    saved.append(checker)
+                    checker.save_caches()
+
+    def _select_checkers(self, api_info):
+        key = (repr(getattr(api_info, "LANGUAGE", '')), self.checker)
+        try:
+            return self.checkers[key]
+        except KeyError:
+            checkers = self.checkers[key] = _select_checkers(api_info, self.checker, self.silent)
+            return checkers
 
-def _update_version(digest, old_digest, version, prerelease, build_metadata, db,
-                    silent, api_info, old_api, dry_run, serialized_api, db_entry,
-                    _file):
+    def _check(self, api_info, directory, db, checkers, api=None):
+        import _checker
+        cache = (_checker.Check_Cache(db, checkers, api_info.PROJECT, directory, True, self.force_check)
+                 if checkers else None)
+        try:
+            _run_invariant_checker(api_info, self.no_invariant_check, self.silent, self.checker,
+                                   directory, self.check_processes, self.check_timeout,
+                                   checkers, cache, api)
+        finally: # the items that passed are cached even if others did not
+            if cache is not None:
+                rows, updates = cache.pending_rows()
+                if rows or updates:
+                    self.pending_caches.append((db, updates, tuple(), rows))
+
+
+def _plan_files(plan, changelog):
+    """Returns the (filename, contents) of the api file (if its version changes) and the changelog file of plan.
+
+       Raises IOError if they cannot be written, so that Session.apply_all fails before it writes anything."""
+    files = []
+    if plan.update:
+        filename = plan.api_info.__file__
+        files.append((filename, _apifile.patch_version(filename, plan.old_version, plan.new_version)))
+    files.append((os.path.join(os.path.split(plan.api_file)[0], changelog or "apichangelog.txt"), plan.changelog))
+    for filename, _ in files:
+        directory = os.path.dirname(os.path.realpath(filename)) # where replace_file creates its temporary file
+        if not os.access(directory, os.W_OK):
+            code = errno.EACCES if os.path.isdir(directory) else errno.ENOENT
+            raise IOError(code, os.strerror(code), filename)
+    return files
+
+def _write_plan(plan):
+    """Writes plan to the database, inside of the transaction of Session.apply_all."""
+    db, api_info = plan.db, plan.api_info
+    if plan.insert or plan.rebaseline:
+        db.store_api_info(plan.project, plan.digest, plan.serialized_api, DIGEST_FORMAT)
+    elif plan.migrate_api is not None: # rewrite the stored API in the current format
+        db.store_api_info(plan.project, plan.basis, serialize(_apientry.to_api(plan.migrate_api)), DIGEST_FORMAT)
+    if plan.update:
+        db.store_api_info(plan.project, plan.digest, plan.serialized_api, DIGEST_FORMAT)
+        db.record_version(plan.project, plan.new_version, plan.digest, api_info.API)
+    elif plan.record:
+        db.record_version(plan.project, plan.old_version, plan.digest, api_info.API)
+    if plan.store_tree:
+        db.store_tree(plan.project, plan.tree[0], plan.tree[1])
+    if plan.checker_names is not None:
+        db.store_check_status(plan.project, plan.digest, plan.checker_names)
+
+def _stored_digest(db, project_name):
+    db_entry = db.load_api_info(project_name)
+    return db_entry[0] if db_entry else None
+
+def _version_helper(api_filename, directory='', version='', prerelease='',
+                    build_metadata='', db='', checker='', source_types=tuple(),
+                    no_invariant_check=False, dry_run=False, silent=False,
+                    rehash=False, workers=0, check_processes=1, check_timeout=0,
+                    use_git=False, staged=False, include=tuple(), exclude=tuple(),
+                    source_files=tuple(), output_format="text", changelog='',
+                    force_check=False):
+    if output_format not in ("text", "json"):
+        raise ValueError("Unknown output format '{}'".format(output_format))
+    quiet = silent or output_format == "json"
+    if dry_run and not quiet:
+        print("Performing a dry run; Changes will not be written to DB or API file")
+
+    session = Session(db, checker, source_types, no_invariant_check, rehash, workers,
+                      check_processes, check_timeout, use_git, staged, include, exclude,
+                      force_check, quiet)
+    _timing.start(api_filename)
+    for attempt in range(PLAN_RETRIES + 1):
+        try:
+            plan = session.plan(api_filename, directory, version, prerelease, build_metadata,
+                                source_files)
+        finally:
+            if not dry_run:
+                session.save_caches()
+        if dry_run:
+            break
+        try:
+            session.apply(plan, changelog)
+        except Stale_Plan:
+            if attempt == PLAN_RETRIES:
+                raise
+        else:
+            break
+    summary = plan.to_dict()
+    summary["timings"] = _timing.stop()
+    summary["error"] = None
+    if not silent:
+        if output_format == "json":
+            import json
+            print(json.dumps(summary, indent=4, sort_keys=True))
+        else:
+            sys.stdout.write(plan.changelog)
+    return summary
+
+def _update_version(digest, old_digest, version, prerelease, build_metadata,
+                    api_info, old_api, db_entry, _file, api=None):
+    """Writes the changelog messages to _file.
+
+       api is compared with old_api if it is supplied (e.g. the Api_Entry records of api_info.API);
+       otherwise, api_info.API is.
+
+       Returns the new version, the change, the Change_Report (None unless the API was compared)
+       and whether the new version should be written to the api file and database."""
+    report = None
     if digest != old_digest or version or prerelease or build_metadata:
         if version: # explicitly set a version number
             new_version = _attach_metadata(version, prerelease, build_metadata)
+            change = "set"
             message = "Set version to {} (from {})".format(new_version, api_info.VERSION)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
         elif not db_entry: # first run, don't increment version
             new_version = _attach_metadata(api_info.VERSION, prerelease, build_metadata)
+            change = "first run"
             message = "First run, version is set to {}".format(api_info.VERSION)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
         elif digest != old_digest: # changes have happened, update version accordingly
-            new_version = _determine_new_version(api_info, old_api, silent, _file)
+            with _timing.phase("diff"):
+                report, new_version = _determine_new_version(api_info, old_api, _file, api)
+                change = report.change_type
             new_version = _attach_metadata(new_version, prerelease, build_metadata)
             message = "Changed version from {} to {}".format(api_info.VERSION, new_version)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
         else: # only handle prerelease/build_metadata
             version = api_info.VERSION
             new_version = _attach_metadata(version, prerelease, build_metadata)
+            change = "metadata"
             format_info = []
             if prerelease:
                 format_info.append("prerelease")
@@ -141,36 +776,28 @@ def _update_version(digest, old_digest, version, prerelease, build_metadata, db,
             formatted = " and ".join(format_info)
             message = "Added {} to version: {} -> {}".format(formatted, version, new_version)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
-        if not dry_run:
-            _write_version(api_info.__file__, api_info.VERSION, new_version)
-            db.update_table("Api_Info", where={"project" : api_info.PROJECT},
-                            arguments={"digest" : digest, "api" : serialized_api})
+        return new_version, change, report, True
     else:
         if db_entry:
+            change = None
             message = "No changes. Version number: {}".format(api_info.VERSION)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
         else:
+            change = "first run"
             message = "First run, version is set to {}".format(api_info.VERSION)
             _file.write(message + "\n")
-            if not silent:
-                print(message)
+        return api_info.VERSION, change, report, False
 
-def _obtain_old_api_info(db, project_name, dry_run, api_info, digest, serialized_api):
-    db_entry = db.query("Api_Info", retrieve_fields=("digest", "api"),
-                                    where={"project" : project_name})
+def _obtain_old_api_info(db, project_name, api_info, digest):
+    """Returns the stored digest and API of project_name and the Api_Info row (None on the first run).
+
+       The stored API is returned as Api_Entry records (see _apientry.build_entries).
+       On the first run, the stored digest and API are digest and the API of api_info."""
+    db_entry = db.load_api_info(project_name)
     if not db_entry:
-        if not dry_run:
-            db.insert_into("Api_Info", (project_name, digest, serialized_api))
-        old_digest = digest
-        old_api = api_info.API
-    else:
-        old_digest, old_api = db_entry
-        old_api = deserialize(old_api)
-    return old_digest, old_api, db_entry
+        return digest, api_info.API, db_entry
+    old_digest, old_api = db_entry[:2]
+    return old_digest, _apientry.build_entries(deserialize(old_api)), db_entry
 
 def _determine_source_types(api_info):
     language = getattr(api_info, "LANGUAGE", '')
@@ -186,35 +813,80 @@ def _determine_source_types(api_info):
     else:
         return source_types
 
-def _run_invariant_checker(api_info, no_invariant_check, silent, checker, directory):
+def _run_invariant_checker(api_info, no_invariant_check, silent, checker, directory,
+                           processes=1, timeout=0, checkers=None, cache=None, api=None):
+    """Runs the invariant checker(s) for api_info against the source in directory.
+
+       checkers are the checker modules to use; they are selected with _select_checkers if it is None.
+       If cache (a _checker.Check_Cache) is supplied, items whose API entry and defining files are
+       unchanged since they last passed are not checked again.
+       api is checked instead of api_info.API if it is supplied (e.g. its Api_Entry records)."""
     if no_invariant_check:
         if not silent:
             print("Skipping invariant checker")
     else:
-        languages = getattr(api_info, "LANGUAGE", '')
-        checkers = []
-        if not checker:
-            if not languages:
-                if not silent:
-                    print("No language or invariant checker specified. Unable to run invariant checker")
-            else:
-                if isinstance(languages, str):
-                    languages = [languages]
-                for language in languages:
-                    if language == "python":
-                        checkers.append(pychecker)
-                    else:
-                        if not silent:
-                            print("Checker module for language '{}' not built-in. Unable to check {} files".format(language, language))
-        else: # custom checker(s)
-            for checker_file in checker.split(','):
-                checkers.append(_load_module_from_filename(checker_file.strip(), "checker"))
+        import _checker
+        if checkers is None:
+            checkers = _select_checkers(api_info, checker, silent)
+        module_count = len(sys.modules)
+        api = api_info.API if api is None else api
+        checked = _checker.check_api_items(api, directory, checkers, processes, timeout, cache)
+        _timing.count("items_checked", checked)
+        _timing.count("items_cached", len(api) - checked)
+        _timing.count("modules_imported", len(sys.modules) - module_count)
+
+def _select_checkers(api_info, checker, silent):
+    languages = getattr(api_info, "LANGUAGE", '')
+    checkers = []
+    if not checker:
+        if not languages:
+            if not silent:
+                print("No language or invariant checker specified. Unable to run invariant checker")
+        else:
+            if isinstance(languages, str):
+                languages = [languages]
+            for language in languages:
+                if language in LANGUAGE_CHECKER:
+                    checkers.append(_load_checker(LANGUAGE_CHECKER[language]))
+                else:
+                    if not silent:
+                        print("Checker module for language '{}' not built-in. Unable to check {} files".format(language, language))
+    else: # custom checker(s)
+        for checker_file in checker.split(','):
+            checkers.append(_load_checker(checker_file.strip()))
+    return checkers
+
+def _load_checker(name):
+    """Returns the built-in checker called name, or loads the checker module from the file name."""
+    if name in BUILTIN_CHECKERS:
+        return __import__(name, globals()) # imported the first time it is needed
+    return _load_module_from_filename(name, "checker")
 
-        _checker.check_api_items(api_info.API, directory, checkers)
+def _is_unchanged(db, project_name, digest, checker_names):
+    """Returns True if digest is the stored digest of project_name (in the current DIGEST_FORMAT) and,
+       unless checker_names is None, the checkers named by checker_names passed when it was stored."""
+    db_entry = db.load_api_info(project_name)
+    if db_entry is None or db_entry[0] != digest or db_entry[2] != DIGEST_FORMAT:
+        return False
+    return checker_names is None or db.load_check_status(project_name) == (digest, checker_names)
+
+def _checker_names(checkers):
+    """Returns a string that identifies the list of checkers."""
+    return ','.join(sorted(_checker_name(checker) for checker in checkers))
+
+def _checker_name(checker):
+    """Returns the name that _load_checker would use to load checker."""
+    name = checker.__name__.rpartition('.')[2]
+    if name in BUILTIN_CHECKERS and _load_checker(name) is checker:
+        return name
+    return checker.__file__
 
 def _load_module_from_filename(filename, module_name):
     with open(filename, 'r') as _file:
         source = _file.read()
+    return _load_module_from_source(source, filename, module_name)
+
+def _load_module_from_source(source, filename, module_name):
     module_code = compile(source, module_name, "exec")
     module = types.ModuleType("api")
     exec module_code in module.__dict__
@@ -248,16 +920,13 @@ def _attach_metadata(new_version, prerelease, build_metadata):
         new_version += "+" + build_metadata
     return new_version
 
-def _determine_new_version(api_info, old_api, silent, _file):
-    change_type = _determine_change_type(api_info.API, old_api, silent, _file)
-    return _increment_version(change_type, api_info.VERSION, silent, _file)
+def _determine_new_version(api_info, old_api, _file, api=None):
+    report = _determine_change_type(api_info.API if api is None else api, old_api, _file)
+    return report, _increment_version(report.change_type, api_info.VERSION, _file)
 
-def _increment_version(change_type, current_version, silent, _file):
+def _increment_version(change_type, current_version, _file):
     major, minor, patch, prerelease, build_metadata = parse_version(current_version)
-    message = "Change type: {}".format(change_type)
-    _file.write(message + "\n")
-    if not silent:
-        print(message)
+    _file.write("Change type: {}\n".format(change_type))
     if prerelease:
         checked = []
         values = prerelease.split('.')
@@ -308,233 +977,141 @@ def parse_version(version):
             build_metadata = ''
     return major, minor, patch, prerelease, build_metadata
 
-def _write_version(api_file, current_version, new_version):
-    with open(api_file, "r+") as _file:
-        assert _file.tell() == 0
-        source = _file.read().replace("VERSION = \"{}\"".format(current_version),
-                                      "VERSION = \"{}\"".format(new_version), 1)
-        _file.truncate(0)
-        _file.seek(0)
-        assert _file.tell() == 0
-        _file.write(source)
-
-def _obtain_package_digest(package_dir, serialized_api, source_types):
-    """Returns a hash representing the state of the source files in package_dir."""
-    hash_output = hashlib.sha256()
-    for root, _, files in os.walk(package_dir):
-        for filename in files:
-            extension = os.path.splitext(filename)[1][1:] # slice off '.'
-            if extension and extension in source_types:
-                name = os.path.splitext(os.path.split(filename)[1])[0]
-                if name != "api":
-                    with open(os.path.join(root, filename), 'r') as _file:
-                        hash_output.update(_file.read())
-    hash_output.update(serialized_api + "api")
-    return hash_output.hexdigest()
-
-def _determine_change_type(api, old_api, silent, _file):
-    # major changes:
-    #   functions in API removed
-    #   positional arguments removed or re-ordered
-    #   keyword arguments removed or renamed
-    #   return types modified
-    #   exceptions modified
-    #       - not sure if adding return types/exceptions constitutes API breaking change
-    #       - cannot assume that code that uses API will work with alternative return types or catch new exceptions, so it seems major
-    # minor changes:
-    #   functions added to API
-    #   positional arguments added
-    #   keyword arguments added
-    # patch changes:
-    #   anything else
-    #       - includes negligible changes like comments
-    change = "patch"
-
-    function_removals = [method_name for method_name in old_api.keys() if method_name not in api]
-    if function_removals:
-        message = "Major: Following functions were removed:\n    {}".format('\n'.join(item for item in function_removals))
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
+def _obtain_package_digest(package_dir, serialized_api, source_types, db=None,
+                           rehash=False, dry_run=False, workers=0, include=tuple(),
+                           exclude=tuple(), source_files=tuple()):
+    """Returns a hash representing the state of the source files in package_dir, and the source tree.
+
+       If db is supplied, file digests are cached in its File_Digest table and
+       files whose size, mtime and inode have not changed are not re-read.
+       Other files are hashed on workers threads (one per CPU by default).
+       The result is the same whether or not the cache was used."""
+    digest, tree, updates, removed = _hash_package(package_dir, serialized_api, source_types, db,
+                                                   rehash, workers, include, exclude, source_files)
+    if db is not None and not dry_run and (updates or removed):
+        db.store_file_digests(updates, removed)
+    return digest, tree
+
+def _hash_package(package_dir, serialized_api, source_types, db=None, rehash=False, workers=0,
+                  include=tuple(), exclude=tuple(), source_files=tuple()):
+    """Returns the results of _obtain_package_digest, and the entries that should be stored in and
+       removed from the File_Digest table of db. Nothing is written."""
+    package_dir = os.path.abspath(package_dir)
+    filenames = _find_source_files(package_dir, source_types, include, exclude, source_files)
+    cache = db.load_file_digests() if db is not None else dict()
+    file_digests, updates = _digest.obtain_file_digests(filenames, cache, rehash, workers)
+    removed = []
+    if db is not None:
+        prefix = os.path.join(package_dir, '')
+        current = set(filenames)
+        removed = [filename for filename in cache if
+                   filename.startswith(prefix) and filename not in current]
+    digest, tree = _combine_digests(package_dir, filenames, file_digests, serialized_api)
+    return digest, tree, updates, removed
+
+def _obtain_git_digest(package_dir, serialized_api, source_types, staged=False,
+                       workers=0, include=tuple(), exclude=tuple()):
+    """Returns the same digest as _obtain_package_digest, taking the digests of unmodified files from the git index.
+
+       Only files that git tracks, or untracked files that are not ignored, are included; as when
+       package_dir is walked, files ignored by a .gitignore or .vhignore file are left out even if
+       git tracks them. If staged is True, no other files of the working tree are read."""
+    package_dir = os.path.abspath(package_dir)
+    import _git
+    is_source_file = _source_filter(source_types, include, exclude, package_dir)
+    filenames, file_digests = _git.obtain_file_digests(package_dir, is_source_file, staged, workers)
+    _timing.count("files_walked", len(filenames))
+    return _combine_digests(package_dir, filenames, file_digests, serialized_api)
+
+def _find_source_files(package_dir, source_types, include=tuple(), exclude=tuple(),
+                       source_files=tuple()):
+    """Returns a sorted list of the source files in package_dir, excluding api files.
+
+       If source_files is supplied, the files in it that are beneath package_dir are used instead of searching package_dir."""
+    if not source_files:
+        filenames = _walker.walk(package_dir, _source_filter(source_types, include, exclude))
+        _timing.count("files_walked", len(filenames))
+        return filenames
+    package_dir = os.path.abspath(package_dir)
+    matches = _source_filter(source_types, include, exclude, package_dir)
+    filenames = set()
+    for filename in source_files:
+        filename = os.path.abspath(filename)
+        relative_name = os.path.relpath(filename, package_dir).replace(os.sep, '/')
+        if not relative_name.startswith("../") and matches(relative_name):
+            filenames.add(filename)
+    return sorted(filenames)
+
+def _source_filter(source_types, include=tuple(), exclude=tuple(), package_dir=None):
+    """Returns a function that accepts the relative paths of source files that should be tracked.
+
+       If package_dir is supplied, files that _walker.walk would not find beneath it (because of
+       .gitignore and .vhignore files) are rejected as well."""
+    matches_globs = _walker.glob_filter(include, exclude)
+    if package_dir is None:
+        return lambda filename: _is_source_file(filename, source_types) and matches_globs(filename)
+    not_ignored = _walker.ignore_filter(package_dir)
+    return lambda filename: (_is_source_file(filename, source_types) and matches_globs(filename) and
+                             not_ignored(filename))
 
-    for method_name, old_values in old_api.items():
+def _is_source_file(filename, source_types):
+    name, extension = os.path.splitext(os.path.split(filename)[1])
+    extension = extension[1:] # slice off '.'
+    return bool(extension) and extension in source_types and name != "api"
+
+def _combine_digests(package_dir, filenames, file_digests, serialized_api):
+    """Returns the package digest for the sorted filenames and their file_digests, and the source tree.
+
+       The source tree is a Merkle tree of the directories (see _tree); it is returned as the root
+       digest and a dictionary mapping node digest -> entries. The package digest covers the root
+       digest and serialized_api."""
+    prefix = os.path.join(package_dir, '')
+    relative_names = [(filename[len(prefix):] if filename.startswith(prefix) else
+                       os.path.relpath(filename, package_dir)).replace(os.sep, '/') for
+                      filename in filenames]
+    root, nodes = _tree.build_tree(relative_names, file_digests)
+    digest = hashlib.sha256("tree " + root + "\0" + serialized_api + "api").hexdigest()
+    return digest, (root, nodes)
+
+def _compare_source_trees(db, old_root, tree):
+    """Returns the changed, added and removed files between the stored tree old_root and tree."""
+    root, nodes = tree
+    def load_node(digest):
         try:
-            api_values = api[method_name]
-        except KeyError: # function was removed from api
-            continue
-        else:
-            (arguments, old_arguments, keywords, old_keywords,
-             returns, old_returns, exceptions, old_exceptions,
-             side_effects, old_side_effects) = _extract_api_values(api_values, old_values)
-
-        change, positionals_added = _detect_positional_changes(arguments, old_arguments, method_name, change, silent, _file)
-        change, keywords_added = _detect_keyword_changes(keywords, old_keywords, method_name, change, silent, _file)
-        change = _detect_return_changes(returns, old_returns, method_name, change, silent, _file)
-        change = _detect_exception_changes(exceptions, old_exceptions, method_name, change, silent, _file)
-        change, side_effects_added = _detect_side_effect_changes(side_effects, old_side_effects, method_name, change, silent, _file)
-
-        if ((side_effects_added or positionals_added or
-             keywords_added or old_values.get("deprecated", False))
-            and change != "major"):
-            change = "minor"
-
-    new_functions = [method for method in api.keys() if method not in old_api]
-    if new_functions:
-        formatted = ", ".join(new_functions)
-        message = "Minor: Following functions were added:\n    {}".format(formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        if change != "major":
-            change = "minor"
-    return change
-
-def _extract_api_values(api_values, old_values):
-    arguments = api_values.get("arguments", None)
-    keywords = api_values.get("keywords", None)
-    returns = api_values.get("returns", None)
-    exceptions = api_values.get("exceptions", None)
-    old_arguments = old_values.get("arguments", None)
-    old_keywords = old_values.get("keywords", None)
-    old_returns = old_values.get("returns", None)
-    old_exceptions = old_values.get("exceptions", None)
-    side_effects = api_values.get("side_effects", None)
-    old_side_effects = old_values.get("side_effects", None)
-    output = [arguments or tuple(), old_arguments or tuple(),
-              keywords or dict(), old_keywords or dict()]
-    output += [item or tuple() for item in (returns, old_returns,
-                                            exceptions, old_exceptions,
-                                            side_effects, old_side_effects)]
-    return output
-
-def _detect_positional_changes(arguments, old_arguments, method_name, change, silent, _file):
-    arguments = arguments
-    old_arguments = old_arguments
-    positionals_removed = []
-    positionals_moved = []
-    positionals_added = [argument for argument in arguments if
-                         argument not in old_arguments]
-    for i, argument in enumerate(old_arguments):
-        if argument not in arguments:
-            positionals_removed.append(argument)
-        else:
-            try:
-                if arguments[i] != argument:
-                    positionals_moved.append(argument)
-            except IndexError:
-                break
+            return nodes[digest]
+        except KeyError:
+            return db.load_tree_node(digest)
+    try:
+        return _tree.compare_trees(old_root, root, load_node)
+    except KeyError: # the old tree is incomplete
+        return None
 
-    if positionals_removed:
-        formatted = ", ".join(positionals_removed)
-        message = "Major: Following positional arguments for {} were removed:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if positionals_moved:
-        formatted = "\n".join(positionals_moved)
-        message = "Major: Following positional arguments for {} were moved:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if positionals_added:
-        formatted = ", ".join(positionals_added)
-        message = "Minor: Following positional arguments for {} were added:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        # defer assigning change to minor until after all major changes have been determined
-    return change, bool(positionals_added)
-
-def _detect_keyword_changes(keyword_arguments, old_keyword_arguments, method_name, change, silent, _file):
-    keywords_removed = []
-    keywords_modified = []
-    keywords_added = [(key, value) for key, value in keyword_arguments.items() if
-                      key not in old_keyword_arguments]
-    for key, value in old_keyword_arguments.items():
-        if key not in keyword_arguments:
-            keywords_removed.append(key)
-        elif keyword_arguments[key] != value:
-            keywords_modified.append((key, value, keyword_arguments[key]))
-
-    if keywords_removed:
-        formatted = ", ".join(keywords_removed)
-        message = "Major: Following keyword arguments for {} were removed:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if keywords_modified:
-        formatted = "\n".join("{}: {} -> {}".format(key, value, value2) for key, value, value2 in keywords_modified)
-        message = "Major: Following keyword arguments for {} were modified:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if keywords_added:
-        formatted = "\n".join("    {}: {}".format(key, value) for key, value in keywords_added)
-        message = "Minor: Following keyword arguments for {} were added:\n{}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        # defer assigning change to minor until after all major changes have been determined
-    return change, bool(keywords_added)
-
-def _detect_return_changes(returns, old_returns, method_name, change, silent, _file):
-    returns_removed = [value for value in old_returns if value not in returns]
-    returns_added = [value for value in returns if value not in old_returns]
-    if returns_removed:
-        formatted = ", ".join(returns_removed)
-        message = "Major: Following return types for {} were removed:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if returns_added:
-        formatted = ", ".join(returns_added)
-        message = "Major: Following return types for {} were added:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    return change
-
-def _detect_exception_changes(exceptions, old_exceptions, method_name, change, silent, _file):
-    exceptions_removed = [exception for exception in old_exceptions if exception not in exceptions]
-    exceptions_added = [exception for exception in exceptions if exception not in old_exceptions]
-    if exceptions_removed:
-        formatted = ", ".join(exceptions_removed)
-        message = "Major: Following exceptions for {} were removed:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    if exceptions_added:
-        formatted = ", ".join(exceptions_added)
-        message = "Major: Following exceptions for {} were added:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        change = "major"
-    return change
-
-def _detect_side_effect_changes(side_effects, old_side_effects, method_name, change, silent, _file):
-    side_effects_removed = [effect for effect in old_side_effects if effect not in side_effects]
-    side_effects_added = [effect for effect in side_effects if effect not in old_side_effects]
-    if side_effects_removed:
-        formatted = ", ".join(side_effects_removed)
-        message = "Major: Following side effects for {} were removed:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")#
-        if not silent:
-            print(message)
-        change = "major"
-    if side_effects_added:
-        formatted = ", ".join(side_effects_added)
-        message = "Minor: Following side effects for {} were added:\n    {}".format(method_name, formatted)
-        _file.write(message + "\n")
-        if not silent:
-            print(message)
-        # defer assigning change until later
-    return change, bool(side_effects_added)
+def _render_file_changes(file_changes):
+    if file_changes is None:
+        return ''
+    messages = []
+    for key in ("changed", "added", "removed"):
+        if file_changes[key]:
+            messages.append("Source files {}:\n    {}\n".format(key, "\n    ".join(file_changes[key])))
+    return ''.join(messages)
+
+def compare_apis(api, old_api):
+    """Usage: compare_apis(api, old_api) => Change_Report
+       Compare two API dictionaries (the API attribute of an api file) and return a description of the differences.
+
+       The returned Change_Report has the attributes:
+           change_type: "major", "minor" or "patch"
+           functions_removed: list of API item names that are only in old_api
+           functions_added: list of API item names that are only in api
+           functions: list of Function_Changes for the items in both APIs
+
+       # Side Effects
+       -----------
+       None"""
+    return _diff.compare_apis(api, old_api)
+
+def _determine_change_type(api, old_api, _file):
+    """Writes the messages describing how api differs from old_api to _file and returns the Change_Report."""
+    report = _diff.compare_apis(api, old_api)
+    _file.write(''.join(message + "\n" for message in _diff.render_report(report)))
+    return report
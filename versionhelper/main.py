@@ -1,36 +1,109 @@
 import argparse
+import glob
 import sys
 
-import libvh
-
 PARSER = argparse.ArgumentParser()
-PARSER.add_argument("api", help="The api file to work on")
+PARSER.add_argument("api", nargs="*", help="The api file(s) to work on; glob patterns are expanded")
 PARSER.add_argument("-v", "--version", help="Explicitly sets version to the specified version number.")
 PARSER.add_argument("-d", "--directory", help="Specify a directory where the source code lives, if different from the location of the api file")
 PARSER.add_argument("-p", "--prerelease", help="Specify a pre-release string to be included after the patch number")
 PARSER.add_argument("-b", "--build_metadata", help="Specify build metadata string to be included after the patch number")
 PARSER.add_argument("-db", "--database", help="Specify the database file that stores the prior API version")
-PARSER.add_argument("-c", "--checker", help="Specify (comma separated) file(s) that should provide the `check_api_item` functionality")
+PARSER.add_argument("-c", "--checker", help="Specify (comma separated) file(s) that should provide the `check_api_item` functionality, or the name of a built-in checker (pychecker, astchecker, cchecker)")
 PARSER.add_argument("-x", "--extensions", help="Specify the file extensions of possible source files")
 PARSER.add_argument("-nic", "--no_invariant_check", help="Specify that the invariant checker should not be run", action="store_true")
 PARSER.add_argument("-dry", "--dry_run", help="Perform a dry run; Does not write to DB or API file", action="store_true")
 PARSER.add_argument("-s", "--silent", help="Do not display any information to stdout", action="store_true")
+PARSER.add_argument("-w", "--workers", help="Specify the number of threads used to hash source files (default: one per CPU)", type=int, default=0)
+PARSER.add_argument("-r", "--rehash", help="Ignore cached file digests and re-read every source file", action="store_true")
+PARSER.add_argument("-R", "--root", help="Process every api.py file found beneath the specified directory")
+PARSER.add_argument("-P", "--processes", help="Specify the number of processes used when working on more than one api file (default: one per CPU)", type=int, default=0)
+PARSER.add_argument("-cp", "--check_processes", help="Run the invariant checker in the specified number of processes and report every mismatch", type=int, default=1)
+PARSER.add_argument("-fc", "--force_check", help="Run the invariant checker on every API item, even if nothing changed since it last passed", action="store_true")
+PARSER.add_argument("-ct", "--check_timeout", help="Specify the number of seconds the invariant checker may spend on one API item (with --check_processes)", type=float, default=0)
+PARSER.add_argument("--watch", help="Keep running and print the pending version change whenever the api file or source code changes; nothing is written", action="store_true")
+PARSER.add_argument("--poll_interval", help="Specify the number of seconds between checks when --watch cannot use inotify", type=float, default=1.0)
+PARSER.add_argument("-g", "--git", help="Take the digests of unmodified source files from the git index instead of reading them", action="store_true")
+PARSER.add_argument("--staged", help="Determine the version from the staged api file and source files only (for pre-commit hooks)", action="store_true")
+PARSER.add_argument("-i", "--include", help="Only track source files that match the specified glob (may be repeated)", action="append", default=[])
+PARSER.add_argument("-e", "--exclude", help="Do not track source files that match the specified glob (may be repeated)", action="append", default=[])
+PARSER.add_argument("--stdin", help="Read the source files to track from stdin as a NUL-separated list (e.g. from `git ls-files -z`)", action="store_true")
+PARSER.add_argument("-f", "--format", help="Print the result as text (default) or as a JSON object (a list with more than one api file)", choices=("text", "json"), default="text")
+PARSER.add_argument("-l", "--changelog", help="Specify the changelog file, relative to the api file (default: apichangelog.txt)")
+PARSER.add_argument("--timings", help="Write a JSON record of the wall clock time, CPU time and peak memory of each phase, and counters, to the specified file (default: stdout)", nargs="?", const="-")
+PARSER.add_argument("--profile", help="Write cProfile statistics to the specified file (worker processes are not included)")
 
 def main():
-    if "--site_config" in sys.argv:
-        sys.argv.remove("--site_config")
-        sys.argv.remove("Alert_Handler.defaults={\'parse_args\':False}")
     args = PARSER.parse_args()
-    libvh.version_helper(args.api, args.directory, args.version,
-                         args.prerelease, args.build_metadata,
-                         args.database, args.checker, args.extensions,
-                         args.no_invariant_check, args.dry_run, args.silent)
+    import libvh # not needed for --help
+    records = []
+    if args.timings:
+        libvh.add_phase_hook(lambda api_filename, phase, record: phase is None and records.append(record))
+    if args.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        summaries = _run(args)
+    finally:
+        if args.profile:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+    if args.timings:
+        if summaries is None:
+            _write_timings(args.timings, records[0] if records else None)
+        else: # records from worker processes are only available in the summaries
+            _write_timings(args.timings, [summary["timings"] for summary in summaries])
+    if summaries is not None and any(summary["error"] for summary in summaries):
+        sys.exit(1)
+
+def _write_timings(filename, records):
+    import json
+    output = json.dumps(records, indent=4, sort_keys=True)
+    if filename == '-':
+        print(output)
+    else:
+        with open(filename, 'w') as _file:
+            _file.write(output + "\n")
+
+def _run(args):
+    """Runs the mode selected by args; Returns the list of summaries in batch mode and None otherwise."""
+    import libvh
+    import _walker
+    if args.watch:
+        if len(args.api) != 1 or args.root:
+            PARSER.error("--watch works on exactly one api file")
+        libvh.watch(args.api[0], args.directory, args.database, args.checker,
+                    args.extensions, args.no_invariant_check, args.workers,
+                    args.poll_interval, args.include, args.exclude)
+    elif len(args.api) == 1 and not args.root and not glob.has_magic(args.api[0]):
+        source_files = _walker.read_file_list(sys.stdin) if args.stdin else tuple()
+        libvh.version_helper(args.api[0], args.directory, args.version,
+                             args.prerelease, args.build_metadata,
+                             args.database, args.checker, args.extensions,
+                             args.no_invariant_check, args.dry_run, args.silent,
+                             args.rehash, args.workers, args.check_processes,
+                             args.check_timeout, args.git, args.staged,
+                             args.include, args.exclude, source_files,
+                             args.format, args.changelog, args.force_check)
+    else:
+        if not args.api and not args.root:
+            PARSER.error("an api file or --root is required")
+        if args.version or args.directory:
+            PARSER.error("--version and --directory cannot be used with more than one api file")
+        if args.stdin:
+            PARSER.error("--stdin cannot be used with more than one api file")
+        summaries = libvh.batch_version_helper(args.api, args.root, args.processes,
+                                               args.prerelease, args.build_metadata,
+                                               args.database, args.checker,
+                                               args.extensions, args.no_invariant_check,
+                                               args.dry_run, args.silent, args.rehash,
+                                               args.workers, args.check_processes,
+                                               args.check_timeout, args.git, args.staged,
+                                               args.include, args.exclude,
+                                               args.format, args.changelog,
+                                               args.force_check)
+        return summaries
 
 if __name__ == "__main__":
-    if "-m" in sys.argv:
-        sys.argv.remote("-m")
-    # disables the pride Alert_Handler from displaying when --help is used
-    #if "--site_config" not in sys.argv:
-    sys.argv.insert(1, "--site_config")
-    sys.argv.insert(2, "Alert_Handler.defaults={\'parse_args\':False}")
     main()
@@ -6,88 +6,179 @@ import importlib
 import threading
 
 import libvh
+import _pride
 
-import pride.functions.utilities
+LANGUAGES = ("python", )
+SOURCE_EXTENSIONS = (".py", )
+
+_IMPORT_LOCK = threading.RLock()
+_IMPORTERS = dict()
+_RESOLVED = dict()
 
 
 class Local_Importer(object):
+    """Meta path importer for the modules and packages found in source_dir.
+
+       The modules in source_dir are indexed once when the importer is created,
+       so find_module is a dictionary lookup."""
 
     def __init__(self, source_dir):
         self.source_dir = source_dir
-        self.source = dict()
+        self.index = _index_modules(source_dir)
 
-    def find_module(self, module, path):
-        try:
-            _file, filepath, _ = imp.find_module(module, [self.source_dir])
-        except ImportError:
-            pass
-        else:
-            self.source[module] = _file.read(), filepath
-            _file.close()
+    def find_module(self, module_name, path=None):
+        if module_name in self.index:
             return self
 
     def load_module(self, module_name):
-        thread_count = threading.active_count()
-        if thread_count != 1 :
-            while imp.lock_held():
+        with _IMPORT_LOCK:
+            try:
+                return sys.modules[module_name]
+            except KeyError:
                 pass
-            imp.acquire_lock()
-
-        module = sys.modules.setdefault(module_name, imp.new_module(module_name))
+            filepath, is_package = self.index[module_name]
+            with open(filepath, 'r') as _file:
+                module_code = compile(_file.read(), filepath, "exec")
+            module = imp.new_module(module_name)
+            module.__file__ = filepath
+            module.__loader__ = self
+            if is_package:
+                module.__path__ = [os.path.dirname(filepath)]
+                module.__package__ = module_name
+            else:
+                module.__package__ = module_name.rpartition('.')[0] or None
+            sys.modules[module_name] = module
+            try:
+                exec module_code in module.__dict__
+            except:
+                del sys.modules[module_name]
+                raise
+            return module
+
+
+def _index_modules(source_dir):
+    """Returns a dictionary mapping dotted module name -> (filepath, is_package) for source_dir.
+
+       If source_dir is itself a package, its modules are also indexed under the package name."""
+    index = dict()
+    prefixes = ['']
+    if os.path.isfile(os.path.join(source_dir, "__init__.py")):
+        package_name = os.path.basename(os.path.abspath(source_dir))
+        prefixes.append(package_name + '.')
+        index[package_name] = (os.path.join(source_dir, "__init__.py"), True)
+    for root, directories, files in os.walk(source_dir):
+        relative = os.path.relpath(root, source_dir)
+        package = '' if relative == os.curdir else relative.replace(os.sep, '.') + '.'
+        if package and "__init__.py" not in files:
+            del directories[:]
+            continue
+        for filename in files:
+            name, extension = os.path.splitext(filename)
+            if extension == ".py":
+                is_package = name == "__init__"
+                module_name = package[:-1] if is_package else package + name
+                if module_name:
+                    for prefix in prefixes:
+                        index[prefix + module_name] = (os.path.join(root, filename), is_package)
+        directories[:] = [name for name in directories if name[0] != '.']
+    return index
+
+def get_importer(source_dir):
+    """Returns the Local_Importer for source_dir, installing it in sys.meta_path the first time."""
+    with _IMPORT_LOCK:
+        try:
+            return _IMPORTERS[source_dir]
+        except KeyError:
+            importer = _IMPORTERS[source_dir] = Local_Importer(source_dir)
+            sys.meta_path.append(importer)
+            return importer
 
-        if thread_count != 1:
-            imp.release_lock() # not sure when to release; the following doesn't use shared resources (e.g. sys.modules) other than the module itself
+def resolve(function_name, source_dir):
+    """Returns the object named by function_name, importing its module from source_dir if necessary.
 
-        source, filepath = self.source.pop(module_name)
-        module_code = compile(source, module_name, "exec")
-        is_package = True if len(module_name.split('.')) > 1 else False # not sure, but seems accurate
-        module.__file__ = filepath
-        module.__loader__ = self
-        if is_package:
-            module.__path__ = []
-            module.__package__ = module_name
-        else:
-            module.__package__ = module_name.split('.', 1)[0]
-        exec module_code in module.__dict__
-        #imp.release_lock() # it might be more correct to release the lock here instead of above.
-        return module
+       Modules found in source_dir take precedence over installed modules of the same name."""
+    try:
+        return _RESOLVED[(source_dir, function_name)]
+    except KeyError:
+        pass
+    importer = get_importer(source_dir)
+    segments = function_name.split('.')
+    for index in range(len(segments) - 1, 0, -1):
+        module_name = '.'.join(segments[:index])
+        if sys.modules.get(module_name) is not None or module_name in importer.index:
+            module = importlib.import_module(module_name)
+            break
+    else:
+        try: # works if it is installed
+            utilities = _pride.import_module("pride.functions.utilities")
+            function = utilities.resolve_string(function_name)
+        except (AttributeError, ValueError, ImportError):
+            raise libvh.Missing_Api_Functionality("Unable to locate {}".format(function_name))
+        _RESOLVED[(source_dir, function_name)] = function
+        return function
 
+    function = module
+    for attribute in segments[index:]:
+        try:
+            function = getattr(function, attribute)
+        except AttributeError:
+            message = "{} does not exist".format(function_name)
+            raise libvh.Missing_Api_Functionality(message)
+    _RESOLVED[(source_dir, function_name)] = function
+    return function
+
+def forget(filenames):
+    """Discards imported modules and resolved names that came from filenames, so they are reloaded on the next check."""
+    filenames = set(os.path.abspath(filename) for filename in filenames)
+    with _IMPORT_LOCK:
+        for module_name, module in sys.modules.items():
+            filepath = getattr(module, "__file__", None)
+            if filepath and isinstance(getattr(module, "__loader__", None), Local_Importer):
+                if os.path.abspath(filepath) in filenames:
+                    del sys.modules[module_name]
+        _RESOLVED.clear()
+        for importer in _IMPORTERS.values(): # files may have been created or deleted
+            known = set(os.path.abspath(filepath) for filepath, _ in importer.index.values())
+            if any(filename not in known or not os.path.exists(filename) for
+                   filename in filenames if filename.endswith(".py")):
+                importer.index = _index_modules(importer.source_dir)
 
 def check_api_item(function_name, values, source_dir):
-    importer = Local_Importer(source_dir)
-    try: # works if it is installed
-        assert importer not in sys.meta_path
-        function = pride.functions.utilities.resolve_string(function_name)
-    except (AttributeError, ValueError): # look in source_dir instead
-        sys.meta_path.insert(0, importer)
-        segments = function_name.split('.')
-        for index in range(1, len(segments) + 1):
-            module_name = '.'.join(segments[:-index])
-            try:
-                module = importlib.import_module(module_name)
-            except ImportError:
-                continue
-            else:
-                try:
-                    function = getattr(module, '.'.join(segments[index:]))
-                except AttributeError:
-                    message = "{} does not exist".format(function_name)
-                    raise libvh.Missing_Api_Functionality(message)
-                sys.meta_path.remove(importer)
-                break
-        else:
-            sys.meta_path.remove(importer)
-            raise libvh.Missing_Api_Functionality("Unable to locate {}".format(function_name))
-    assert importer not in sys.meta_path
-    determine_consistency(function_name, values, function)
+    determine_consistency(function_name, values, resolve(function_name, source_dir))
+
+def describe_api_item(function_name, source_dir):
+    """Returns the files that the check of function_name depends on and its signature string.
+
+       The files are the module that function_name was resolved from and the files that define
+       the object and (for a class) its __init__."""
+    function = resolve(function_name, source_dir)
+    filenames = set()
+    segments = function_name.split('.')
+    for index in range(len(segments) - 1, 0, -1):
+        module = sys.modules.get('.'.join(segments[:index]))
+        if module is not None:
+            filenames.add(inspect.getsourcefile(module) if hasattr(module, "__file__") else None)
+            break
+    for item in (function, getattr(function, "__init__", None)):
+        try:
+            filenames.add(inspect.getsourcefile(item))
+        except TypeError: # built-in
+            pass
+    filenames.discard(None)
+    return sorted(os.path.abspath(filename) for filename in filenames), inspect.formatargspec(*_arg_spec(function))
 
 def determine_consistency(function_name, values, function):
-    api_arguments = values.get("arguments", None) or tuple()
+    check_arg_spec(function_name, values, _arg_spec(function))
+
+def _arg_spec(function):
     try:
-        arg_spec = inspect.getargspec(function)
+        return inspect.getargspec(function)
     except TypeError: # 'function' may be a class
-        arg_spec = inspect.getargspec(function.__init__)
+        return inspect.getargspec(function.__init__)
 
+def check_arg_spec(function_name, values, arg_spec):
+    """Raises libvh.Mismatched_Api_Argument if arg_spec (an inspect.ArgSpec) differs from the API values."""
+    api_arguments = values.get("arguments", None) or tuple()
     try:
         spec_keywords = dict((key, value) for key, value in zip(arg_spec.args[::-1],
                                                                 arg_spec.defaults[::-1]))